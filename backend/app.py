@@ -1,20 +1,26 @@
 import os
+import hmac
+import hashlib
+import json
+import math
+import time
+import threading
 import tempfile
 import traceback
 import numpy as np
-from flask import Flask, request, jsonify
-import importlib.util
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import subprocess
-import shutil
 
-
-def load_pred_module(project_root):
-    pred_path = os.path.join(project_root, "contexts", "pred_with_audio.py")
-    spec = importlib.util.spec_from_file_location("pred_with_audio", pred_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+import jobs
+import uploads
+from inference import load_model, predict_file, read_header_preview, run_model, to_probabilities
+from scheduler import (
+    InferenceScheduler, LiveDemandFlag, SchedulerBusy,
+    cap_priority, parse_limits, parse_priority, parse_priority_caps,
+)
+from profiling import Profiler, ProfileStore
+from ratelimit import SharedTokenBuckets, bucket_hash, parse_rate
+from cascade import load_cascade
 
 
 def create_app():
@@ -48,78 +54,254 @@ def create_app():
 
     project_root = os.path.dirname(os.path.abspath(__file__))
 
-    # Load helper module that contains preprocessing and class names
-    pred_mod = load_pred_module(project_root)
-    audio_to_mel_image = getattr(pred_mod, "audio_to_mel_image")
-    class_names = getattr(pred_mod, "class_names")
-
-    # Try to reuse interpreter loaded by pred_with_audio.py if present
-    interpreter = getattr(pred_mod, "interpreter", None)
-    input_details = getattr(pred_mod, "input_details", None)
-    output_details = getattr(pred_mod, "output_details", None)
-
-    if interpreter is None:
-        import tensorflow as tf
-        model_path = os.path.join(project_root, "contexts", "model_int8.tflite")
-        interpreter = tf.lite.Interpreter(model_path=model_path)
-        interpreter.allocate_tensors()
-        input_details = interpreter.get_input_details()
-        output_details = interpreter.get_output_details()
-
-    # Optional API key enforcement
-    API_KEY = os.environ.get("PRED_API_KEY")
+    # Load preprocessing helpers, class names and the TFLite interpreter.
+    # A TFLite interpreter is not safe to invoke concurrently, so each scheduler
+    # slot gets its own copy.
+    infer_slots = max(1, int(os.environ.get("INFER_SLOTS", "1")))
+    models = [load_model(project_root) for _ in range(infer_slots)]
+    model = models[0]
+    audio_to_mel_image = model['audio_to_mel_image']
+    class_names = model['class_names']
+
+    # Optional early-exit cascade (CASCADE_STAGES); None keeps every request on the full model
+    cascade = load_cascade(project_root, class_names)
+    if cascade is not None:
+        print(f"[startup] cascade stages={[st.name for st in cascade.stages]} escalate_events={sorted(cascade.escalate_events)}")
+
+    # Priority scheduler in front of interpreter.invoke(): live > interactive > bulk
+    queue_timeout = float(os.environ.get("SCHED_QUEUE_TIMEOUT", "120")) or None
+    scheduler = InferenceScheduler(
+        models,
+        limits=parse_limits(os.environ.get("SCHED_LIMITS"), infer_slots),
+        queue_timeout=queue_timeout,
+        # tells the /jobs workers (other processes) to hold back bulk work
+        live_flag=LiveDemandFlag(),
+    )
+    print(f"[startup] inference slots={infer_slots} limits={scheduler.limits} queue_timeout={queue_timeout}")
+
+    # Optional API key enforcement. PRED_API_KEYS holds "name=secret" pairs;
+    # the legacy single PRED_API_KEY is registered under the name "default".
+    API_KEYS = load_api_keys()
+    print(f"[startup] API keys configured: {sorted(set(API_KEYS.values())) or 'none (open access)'}")
+
+    # Highest priority class each key may request, e.g. PRIORITY_KEYS="mobile=live,batch=bulk";
+    # everyone else (including anonymous callers) is capped at PRIORITY_DEFAULT_MAX
+    PRIORITY_CAPS = parse_priority_caps(os.environ.get("PRIORITY_KEYS"))
+    PRIORITY_DEFAULT_MAX = parse_priority(os.environ.get("PRIORITY_DEFAULT_MAX"), "interactive")
+    print(f"[startup] priority caps={PRIORITY_CAPS} default_max={PRIORITY_DEFAULT_MAX}")
+
+    # Per-key and per-IP token buckets, shared by all workers on the host
+    RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") in ('1', 'true', 'True')
+    RATE_KEY = parse_rate(os.environ.get("RATE_LIMIT_KEY"), (10.0, 100.0))
+    RATE_IP = parse_rate(os.environ.get("RATE_LIMIT_IP"), (2.0, 30.0))
+    RATE_KEY_OVERRIDES = {
+        name.strip(): parse_rate(spec.strip(), RATE_KEY)
+        for name, _, spec in (p.partition("=") for p in os.environ.get("RATE_LIMIT_KEY_OVERRIDES", "").split(",") if p.strip())
+    }
+    RATE_COST_FFMPEG = float(os.environ.get("RATE_COST_FFMPEG", "3"))
+    RATE_COST_BATCH = float(os.environ.get("RATE_COST_BATCH", "2"))
+    RATE_LONG_AUDIO_BYTES = int(os.environ.get("RATE_LONG_AUDIO_BYTES", "320000"))  # ~10 s of 16 kHz 16-bit WAV
+    TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS") in ('1', 'true', 'True')
+    # number of reverse proxies in front of us that append to X-Forwarded-For
+    TRUSTED_PROXY_COUNT = max(1, int(os.environ.get("TRUSTED_PROXY_COUNT", "1")))
+    # Behind a proxy without TRUST_PROXY_HEADERS every caller has the proxy's
+    # remote_addr, and one shared per-IP bucket would cap the whole service.
+    # So the per-IP scope is off unless proxy headers are trusted or it is
+    # enabled explicitly for a server exposed directly to clients.
+    RATE_LIMIT_PER_IP = os.environ.get("RATE_LIMIT_PER_IP", "1" if TRUST_PROXY_HEADERS else "0") in ('1', 'true', 'True')
+    # extra cost per admission-controlled endpoint, on top of the base cost of 1;
+    # None means the endpoint only needs a valid key (resumable upload bookkeeping).
+    # Creating a session is charged so abandoned uploads aren't free.
+    ADMISSION_ENDPOINTS = {
+        'predict': 0.0,
+        'predict_debug': 0.0,
+        'submit_job': RATE_COST_BATCH,
+        'upload_create': 0.0,
+        'upload_status': None,
+        'upload_append': None,
+        'upload_delete': None,
+        'upload_finalize': 0.0,
+    }
+    buckets = SharedTokenBuckets(os.environ.get("RATE_LIMIT_SHM")) if RATE_LIMIT_ENABLED else None
+    print(f"[startup] rate limiting enabled={RATE_LIMIT_ENABLED} key={RATE_KEY} ip={RATE_IP if RATE_LIMIT_PER_IP else 'off'}")
+    if RATE_LIMIT_ENABLED and not RATE_LIMIT_PER_IP:
+        print("[startup] per-IP rate limit is off; set TRUST_PROXY_HEADERS=1 behind a proxy or RATE_LIMIT_PER_IP=1 when clients connect directly")
+        if not API_KEYS:
+            print("[startup] WARNING: no API keys and no per-IP limit, so requests are not rate limited")
+
+    # Profiling endpoints are only registered when an admin key is configured
+    PROFILE_ADMIN_KEY = os.environ.get("PROFILE_ADMIN_KEY")
+
+    # Resumable uploads: session TTL after last activity and size limits
+    UPLOAD_TTL = float(os.environ.get("UPLOAD_TTL", "3600"))
+    UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    UPLOAD_MAX_CHUNK_BYTES = int(os.environ.get("UPLOAD_MAX_CHUNK_BYTES", str(4 * 1024 * 1024)))
+    UPLOAD_MAX_OPEN = int(os.environ.get("UPLOAD_MAX_OPEN", "16"))  # open sessions per key
+
+    # Long-poll limits for GET /jobs/<id>?wait=N. Each long-poll holds a server thread,
+    # so only a few may wait at once per process; the rest get an immediate answer.
+    JOBS_MAX_WAIT = float(os.environ.get("JOBS_MAX_WAIT", "5"))
+    JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL", "0.5"))
+    JOBS_MAX_LONG_POLLS = int(os.environ.get("JOBS_MAX_LONG_POLLS", "1"))
+    long_poll_slots = threading.BoundedSemaphore(JOBS_MAX_LONG_POLLS) if JOBS_MAX_LONG_POLLS > 0 else None
+    # /jobs refuses work when no worker.py process has checked in this recently
+    JOB_WORKER_TIMEOUT = float(os.environ.get("JOB_WORKER_TIMEOUT", "60"))
+
+
+    def check_api_key():
+        """Return the name of the caller's API key, "anonymous" when keys are disabled, or None."""
+        if not API_KEYS:
+            return "anonymous"
+        key = (request.headers.get("x-api-key") or "").encode()
+        name = None
+        # compare against every key so timing doesn't reveal which one matched
+        for secret, key_name in API_KEYS.items():
+            if hmac.compare_digest(key, secret.encode()):
+                name = key_name
+        return name
+
+
+    def client_ip():
+        """Caller address; behind proxies, the X-Forwarded-For entry our nearest trusted proxy added.
+
+        Entries further left are supplied by the client and can be forged, so
+        we count TRUSTED_PROXY_COUNT entries from the right.
+        """
+        if TRUST_PROXY_HEADERS:
+            forwarded = [p.strip() for p in request.headers.get("X-Forwarded-For", "").split(",") if p.strip()]
+            if len(forwarded) >= TRUSTED_PROXY_COUNT:
+                return forwarded[-TRUSTED_PROXY_COUNT]
+        return request.remote_addr or "unknown"
+
+
+    def long_audio_cost(length):
+        if length > RATE_LONG_AUDIO_BYTES:
+            return math.ceil((length - RATE_LONG_AUDIO_BYTES) / RATE_LONG_AUDIO_BYTES)
+        return 0
+
+
+    def estimate_cost(endpoint):
+        """Token cost from headers only, so it can be decided before the body is read."""
+        cost = 1.0 + ADMISSION_ENDPOINTS[endpoint] + long_audio_cost(request.content_length or 0)
+        # clients may declare a non-WAV upload up front; otherwise it is charged after the header is seen
+        fmt = (request.headers.get("X-Audio-Format") or "").lower()
+        g.ffmpeg_charged = bool(fmt) and fmt not in ('wav', 'wave', 'audio/wav', 'audio/x-wav', 'audio/wave')
+        if g.ffmpeg_charged:
+            cost += RATE_COST_FFMPEG
+        return cost
+
+
+    @app.before_request
+    def admission():
+        """Authenticate and take tokens before the upload body is read; reject fast with 401/429."""
+        if request.method == "OPTIONS" or request.endpoint not in ADMISSION_ENDPOINTS:
+            return None
+        key_name = check_api_key()
+        if key_name is None:
+            return jsonify({"error": "missing or invalid API key"}), 401
+        g.api_key_name = key_name
+        if buckets is None or ADMISSION_ENDPOINTS[request.endpoint] is None:
+            return None
+
+        ip = client_ip()
+        scopes, g.rate_buckets = [], []
+        # without keys every caller shares "anonymous"; only the per-IP bucket is meaningful
+        if API_KEYS:
+            key_rate, key_burst = RATE_KEY_OVERRIDES.get(key_name, RATE_KEY)
+            scopes.append("key")
+            g.rate_buckets.append((bucket_hash("key", key_name), key_rate, key_burst))
+        if RATE_LIMIT_PER_IP:
+            scopes.append("ip")
+            g.rate_buckets.append((bucket_hash("ip", ip), RATE_IP[0], RATE_IP[1]))
+        if not g.rate_buckets:
+            return None
+        cost = estimate_cost(request.endpoint)
+        allowed, retry_after, refused = buckets.take(g.rate_buckets, cost)
+        if allowed:
+            return None
+
+        scope = scopes[refused]
+        print(f"[admission] 429 endpoint={request.endpoint} key={key_name} ip={ip} scope={scope} cost={cost}")
+        resp = jsonify({"error": "rate limit exceeded", "scope": scope, "cost": cost, "retry_after": retry_after})
+        resp.status_code = 429
+        if retry_after is not None:
+            resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        # the body was not read; don't try to reuse the connection
+        resp.headers["Connection"] = "close"
+        return resp
+
+
+    def charge_conversion(path):
+        """Charge the ffmpeg cost for uploads that turned out not to be WAV."""
+        if buckets is None or getattr(g, "ffmpeg_charged", True) or not getattr(g, "rate_buckets", None):
+            return
+        header = read_header_preview(path, 4)
+        if header and header != '52494646':
+            buckets.charge(g.rate_buckets, RATE_COST_FFMPEG)
+            g.ffmpeg_charged = True
+
+
+    def request_priority(default="interactive"):
+        """Priority class from `?priority=` or the `X-Priority` header, capped for the caller's key."""
+        requested = parse_priority(request.args.get('priority') or request.headers.get('X-Priority'), default)
+        key_name = g.get('api_key_name')
+        priority = cap_priority(requested, PRIORITY_CAPS.get(key_name, PRIORITY_DEFAULT_MAX))
+        if priority != requested:
+            print(f"[scheduler] key={key_name} asked for {requested}; capped to {priority}")
+        return priority
+
+
+    def scheduled_invoke(priority):
+        return lambda input_image: scheduler.run(priority, run_model, input_image)
+
+
+    def request_cascade():
+        """The cascade unless the client asks for the full model (`?cascade=0` or `X-Full-Model: 1`)."""
+        if str(request.args.get('cascade', '')).lower() in ('0', 'false') or request.headers.get('X-Full-Model') == '1':
+            return None
+        return cascade
 
 
-    def quantize_input(image: np.ndarray, detail: dict):
-        q = detail.get('quantization', (0.0, 0))
-        scale, zero_point = q if q is not None else (0.0, 0)
-        dtype = detail.get('dtype', None)
-
-        if not scale or scale == 0:
-            return image.astype(np.float32), {
-                'mode': 'float', 'scale': scale, 'zero_point': zero_point, 'dtype': str(dtype)
-            }
-
-        qdata = np.round(image / scale) + zero_point
-        qstr = str(dtype).lower() if dtype is not None else ''
-        if 'uint8' in qstr:
-            qdata = np.clip(qdata, 0, 255).astype(np.uint8)
-        elif 'int8' in qstr:
-            qdata = np.clip(qdata, -128, 127).astype(np.int8)
-        else:
-            qdata = qdata.astype(np.int32)
-
-        return qdata, {'mode': 'quant', 'scale': float(scale), 'zero_point': int(zero_point), 'dtype': str(dtype)}
+    @app.route("/health")
+    def health():
+        return jsonify({"status": "ok"})
 
 
-    def dequantize_output(out_tensor: np.ndarray, detail: dict):
-        q = detail.get('quantization', (0.0, 0))
-        scale, zero_point = q if q is not None else (0.0, 0)
-        if not scale or scale == 0:
-            return out_tensor.astype(np.float32), {'mode': 'float', 'scale': scale, 'zero_point': zero_point}
-        return scale * (out_tensor.astype(np.float32) - zero_point), {'mode': 'dequant', 'scale': float(scale), 'zero_point': int(zero_point)}
+    @app.route("/scheduler")
+    def scheduler_stats():
+        """Per-priority slot usage and queue-wait metrics."""
+        if not check_api_key():
+            return jsonify({"error": "missing or invalid API key"}), 401
+        return jsonify(scheduler.stats())
 
 
-    @app.route("/health")
-    def health():
-        return jsonify({"status": "ok"})
+    @app.route("/cascade")
+    def cascade_stats():
+        """How many requests each cascade stage answered and how many reached the full model."""
+        if not check_api_key():
+            return jsonify({"error": "missing or invalid API key"}), 401
+        if cascade is None:
+            return jsonify({"enabled": False})
+        return jsonify({"enabled": True, **cascade.stats()})
 
 
     @app.route("/predict", methods=["POST"])
     def predict():
-        if API_KEY:
-            key = request.headers.get("x-api-key")
-            if key != API_KEY:
-                return jsonify({"error": "missing or invalid API key"}), 401
+        # API key and rate limits are enforced in admission() before the body is read
         # debug info: log incoming request context
         try:
-            print(f"[predict] method={request.method} remote_addr={request.remote_addr} origin={request.headers.get('Origin')} headers_x_api_key={request.headers.get('x-api-key')}")
+            print(f"[predict] method={request.method} remote_addr={request.remote_addr} origin={request.headers.get('Origin')} api_key={g.get('api_key_name')}")
         except Exception:
             pass
 
         # allow optional debug mode via query param or header
         debug_mode = str(request.args.get('debug', '')).lower() in ('1', 'true') or request.headers.get('X-Debug') == '1'
 
+        try:
+            priority = request_priority()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         if "file" not in request.files:
             return jsonify({"error": "no file provided"}), 400
 
@@ -149,148 +331,262 @@ def create_app():
                 # WAV header is typically 44 bytes; treat smaller files as invalid
                 return jsonify({"error": "uploaded file too small or empty", "path": tmp, "size": file_size}), 400
 
-            # read a small header preview to aid debugging
+            print(f"[predict] saved upload -> {tmp} (size={file_size}) header_preview={read_header_preview(tmp)}")
+            charge_conversion(tmp)
+
+            result = predict_file(model, tmp, debug_mode=debug_mode, tag="predict", invoke=scheduled_invoke(priority), cascade=request_cascade())
+            return jsonify(result)
+
+        except SchedulerBusy as e:
+            return jsonify({"error": str(e), "priority": priority}), 503
+        except Exception as e:
+            tb = traceback.format_exc()
+            return jsonify({"error": str(e), "trace": tb}), 500
+        finally:
+            # cleanup temp file (converted file is removed by predict_file)
             try:
-                with open(tmp, 'rb') as fh:
-                    header_preview = fh.read(128).hex()
+                if tmp and os.path.exists(tmp):
+                    os.remove(tmp)
             except Exception:
-                header_preview = None
-
-            print(f"[predict] saved upload -> {tmp} (size={file_size}) header_preview={header_preview}")
-
-            # If header doesn't start with RIFF (52494646), try converting with ffmpeg.
-            # Many mobile/web recordings use WebM/Opus or other containers which librosa may not decode directly.
-            needs_conversion = True
-            if header_preview and header_preview.startswith('52494646'):
-                needs_conversion = False
-
-            converted = None
-            if needs_conversion:
-                ffmpeg_path = shutil.which('ffmpeg')
-                if ffmpeg_path:
-                    tmp_wav = tmp + '.converted.wav'
-                    cmd = [ffmpeg_path, '-y', '-i', tmp, '-ar', '16000', '-ac', '1', tmp_wav]
-                    proc = subprocess.run(cmd, capture_output=True, text=True)
-                    print(f"[predict] ffmpeg rc={proc.returncode} stdout={proc.stdout[:200]} stderr={proc.stderr[:200]}")
-                    if proc.returncode == 0 and os.path.exists(tmp_wav):
-                        converted = tmp_wav
-                        # update tmp and header_preview for downstream
-                        try:
-                            with open(converted, 'rb') as fh:
-                                header_preview = fh.read(128).hex()
-                        except Exception:
-                            pass
-                    else:
-                        # conversion failed: keep going to try original (librosa may still work), but log
-                        print(f"[predict] ffmpeg conversion failed for {tmp}: rc={proc.returncode}")
-                else:
-                    print("[predict] ffmpeg not found on PATH; cannot convert non-WAV uploads")
-
-            # prefer converted file if available
-            use_path = converted if converted is not None else tmp
-
-            # Load and preprocess audio -> mel image
+                pass
+
+
+    @app.route("/jobs", methods=["POST"])
+    def submit_job():
+        """Queue an upload for asynchronous inference and return a job id immediately."""
+
+        debug_mode = str(request.args.get('debug', '')).lower() in ('1', 'true') or request.headers.get('X-Debug') == '1'
+
+        try:
+            priority = request_priority(default="bulk")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if "file" not in request.files:
+            return jsonify({"error": "no file provided"}), 400
+
+        f = request.files["file"]
+        if f.filename == "":
+            return jsonify({"error": "empty filename"}), 400
+
+        conn = jobs.connect()
+        try:
+            workers_alive = jobs.live_workers(conn, JOB_WORKER_TIMEOUT)
+        finally:
+            conn.close()
+        if not workers_alive:
+            return jsonify({"error": "no job workers are running; use /predict or retry later"}), 503
+
+        path = jobs.spool_path(os.path.splitext(f.filename)[1] or ".wav")
+        try:
+            f.save(path)
+            file_size = os.path.getsize(path)
+            if file_size <= 44:
+                os.remove(path)
+                return jsonify({"error": "uploaded file too small or empty", "size": file_size}), 400
+            charge_conversion(path)
+
+            conn = jobs.connect()
             try:
-                input_image = audio_to_mel_image(use_path)
-            except Exception as e:
-                print(f"[predict] audio_to_mel_image failed for {use_path}: {e}")
-                # if we haven't tried conversion yet, and ffmpeg exists, try now
-                if converted is None and shutil.which('ffmpeg'):
-                    ffmpeg_path = shutil.which('ffmpeg')
-                    tmp_wav = tmp + '.converted.wav'
-                    cmd = [ffmpeg_path, '-y', '-i', tmp, '-ar', '16000', '-ac', '1', tmp_wav]
-                    proc = subprocess.run(cmd, capture_output=True, text=True)
-                    print(f"[predict] ffmpeg retry rc={proc.returncode} stdout={proc.stdout[:200]} stderr={proc.stderr[:200]}")
-                    if proc.returncode == 0 and os.path.exists(tmp_wav):
-                        input_image = audio_to_mel_image(tmp_wav)
-                        use_path = tmp_wav
-                    else:
-                        raise RuntimeError(f"ffmpeg conversion failed: rc={proc.returncode}")
-                else:
-                    raise RuntimeError(f"audio_to_mel_image failed and conversion not available: {e}")
-
-            # collect basic stats for debugging
+                job_id = jobs.enqueue(conn, path, filename=f.filename, debug=debug_mode, priority=priority, owner=g.api_key_name)
+            finally:
+                conn.close()
+            print(f"[jobs] queued job {job_id} filename={f.filename} size={file_size} priority={priority}")
+            return jsonify({
+                "job_id": job_id,
+                "status": jobs.STATUS_QUEUED,
+                "priority": priority,
+                "status_url": f"/jobs/{job_id}",
+            }), 202
+        except Exception as e:
             try:
-                input_stats = {
-                    'min': float(np.min(input_image)),
-                    'max': float(np.max(input_image)),
-                    'mean': float(np.mean(input_image)),
-                    'std': float(np.std(input_image)),
-                    'shape': list(input_image.shape)
-                }
+                if os.path.exists(path):
+                    os.remove(path)
             except Exception:
-                input_stats = None
-
-            input_q, input_meta = quantize_input(input_image, input_details[0])
-
-            interpreter.set_tensor(input_details[0]['index'], input_q)
-            interpreter.invoke()
-
-            raw_out = interpreter.get_tensor(output_details[0]['index'])
-            output_float, out_meta = dequantize_output(raw_out, output_details[0])
-
-            # output_float may already be probabilities (model exported with softmax)
-            arr = output_float[0]
-            # if values in [0,1] and sum approx 1, treat as probs directly
-            if np.all(arr >= -1e-6) and np.all(arr <= 1.0 + 1e-6) and abs(np.sum(arr) - 1.0) < 1e-2:
-                probs = arr.astype(float)
-                probs_list = probs.tolist()
-                logits = arr
-                prob_mode = 'probabilities'
-            else:
-                logits = arr
-                exps = np.exp(logits - np.max(logits))
-                probs = (exps / np.sum(exps)).astype(float)
-                probs_list = probs.tolist()
-                prob_mode = 'logits+softmax'
-
-            scores_map = {class_names[i]: float(probs_list[i]) for i in range(min(len(class_names), len(probs_list)))}
-            top_k_idx = np.argsort(probs)[::-1][:3]
-            top_k = [{"label": class_names[int(i)], "score": float(probs_list[int(i)])} for i in top_k_idx]
-
-            pred_idx = int(np.argmax(probs))
-            pred_label = class_names[pred_idx] if 0 <= pred_idx < len(class_names) else str(pred_idx)
-
-            result = {
-                "pred_idx": pred_idx,
-                "pred_label": pred_label,
-                "scores": probs_list,
-                "scores_map": scores_map,
-                "top_k": top_k,
-                "prob_mode": prob_mode,
-                "header_preview": header_preview,
-            }
-            # when debug mode requested, add internals so we can inspect why 'unknown' appears
-            if debug_mode:
-                try:
-                    result.update({
-                        'input_stats': input_stats,
-                        'input_meta': input_meta,
-                        'output_meta': out_meta,
-                        'raw_output': raw_out.tolist(),
-                        'logits': output_float[0].tolist(),
-                        'class_names_len': len(class_names),
-                    })
-                    print(f"[predict] debug result included (input shape={input_stats.get('shape') if input_stats else 'n/a'})")
-                except Exception:
-                    pass
+                pass
+            tb = traceback.format_exc()
+            return jsonify({"error": str(e), "trace": tb}), 500
+
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        """Return job status/result. `?wait=N` long-polls up to N seconds for completion."""
+        key_name = check_api_key()
+        if key_name is None:
+            return jsonify({"error": "missing or invalid API key"}), 401
+
+        try:
+            wait = min(float(request.args.get('wait', 0) or 0), JOBS_MAX_WAIT)
+        except ValueError:
+            return jsonify({"error": "invalid wait parameter"}), 400
+
+        # over the long-poll budget: answer immediately rather than tie up another thread
+        long_poll = wait > 0 and long_poll_slots is not None and long_poll_slots.acquire(blocking=False)
+        conn = jobs.connect()
+        try:
+            deadline = time.time() + (wait if long_poll else 0)
+            while True:
+                job = jobs.get(conn, job_id, key_name)
+                if job is None:
+                    return jsonify({"error": "unknown job id"}), 404
+                if job["status"] in (jobs.STATUS_DONE, jobs.STATUS_FAILED) or time.time() >= deadline:
+                    break
+                time.sleep(JOBS_POLL_INTERVAL)
+        finally:
+            conn.close()
+            if long_poll:
+                long_poll_slots.release()
+        if wait > 0 and not long_poll:
+            job["long_poll"] = "busy"
+
+        if job["status"] == jobs.STATUS_QUEUED:
             try:
-                print(f"[predict] result pred_label={pred_label} pred_idx={pred_idx} top1_score={probs_list[pred_idx] if 0<=pred_idx<len(probs_list) else None}")
+                conn = jobs.connect()
+                job["queue_depth"] = jobs.queue_depth(conn)
+                conn.close()
             except Exception:
                 pass
+        return jsonify(job)
 
-            return jsonify(result)
 
+    def upload_error(e):
+        return jsonify({"error": str(e), **e.extra}), e.status
+
+
+    @app.route("/uploads", methods=["POST"])
+    def upload_create():
+        """Start a resumable upload. JSON body: filename, size (bytes), checksum (sha256, optional)."""
+        params = request.get_json(silent=True) or {}
+        conn = uploads.connect()
+        try:
+            uploads.purge_expired(conn)
+            row = uploads.create(
+                conn, g.api_key_name,
+                filename=params.get('filename'),
+                size=params.get('size'),
+                checksum=params.get('checksum'),
+                ttl=UPLOAD_TTL,
+                max_bytes=UPLOAD_MAX_BYTES,
+                max_open=UPLOAD_MAX_OPEN,
+            )
+            print(f"[uploads] created {row['id']} filename={row['filename']} size={row['size']} key={g.api_key_name}")
+            return jsonify(uploads.to_public(row)), 201
+        except uploads.UploadError as e:
+            return upload_error(e)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": f"invalid upload parameters: {e}"}), 400
+        finally:
+            conn.close()
+
+
+    @app.route("/uploads/<upload_id>", methods=["GET"])
+    def upload_status(upload_id):
+        """Current offset, so a client can resume after a dropped connection."""
+        conn = uploads.connect()
+        try:
+            row = uploads.get(conn, upload_id, g.api_key_name)
+            resp = jsonify(uploads.to_public(row))
+            resp.headers["Upload-Offset"] = str(row["received"])
+            return resp
+        except uploads.UploadError as e:
+            return upload_error(e)
+        finally:
+            conn.close()
+
+
+    @app.route("/uploads/<upload_id>", methods=["PATCH"])
+    def upload_append(upload_id):
+        """Append the raw request body at the `Upload-Offset` header (or `?offset=`)."""
+        try:
+            offset = int(request.headers.get("Upload-Offset", request.args.get("offset", "")))
+        except ValueError:
+            return jsonify({"error": "Upload-Offset header required"}), 400
+        length = request.content_length
+        if length is not None and length > UPLOAD_MAX_CHUNK_BYTES:
+            return jsonify({"error": f"chunk exceeds {UPLOAD_MAX_CHUNK_BYTES} bytes"}), 413
+
+        # read the chunk before taking the session lock, but never more than the limit:
+        # chunked transfer encoding has no Content-Length to check up front
+        data = read_limited(request.stream, UPLOAD_MAX_CHUNK_BYTES + 1)
+        if len(data) > UPLOAD_MAX_CHUNK_BYTES:
+            resp = jsonify({"error": f"chunk exceeds {UPLOAD_MAX_CHUNK_BYTES} bytes"})
+            resp.status_code = 413
+            # the rest of the body was not read; don't try to reuse the connection
+            resp.headers["Connection"] = "close"
+            return resp
+        chunk_checksum = request.headers.get("X-Chunk-Checksum")
+        conn = uploads.connect()
+        try:
+            uploads.purge_expired(conn)
+            if chunk_checksum and uploads.parse_checksum(chunk_checksum) != hashlib.sha256(data).hexdigest():
+                return jsonify({"error": "chunk checksum mismatch"}), 422
+            new_offset = uploads.append(
+                conn, upload_id, g.api_key_name, offset, data,
+                ttl=UPLOAD_TTL, max_bytes=UPLOAD_MAX_BYTES,
+            )
+            resp = jsonify({"upload_id": upload_id, "offset": new_offset})
+            resp.headers["Upload-Offset"] = str(new_offset)
+            return resp
+        except uploads.UploadError as e:
+            return upload_error(e)
+        finally:
+            conn.close()
+
+
+    @app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+    def upload_finalize(upload_id):
+        """Verify size/checksum and run inference once; repeated calls return the stored result."""
+        params = request.get_json(silent=True) or {}
+        debug_mode = str(request.args.get('debug', '')).lower() in ('1', 'true') or request.headers.get('X-Debug') == '1'
+        try:
+            priority = request_priority()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        conn = uploads.connect()
+        try:
+            uploads.purge_expired(conn)
+            row = uploads.begin_finalize(conn, upload_id, g.api_key_name, checksum=params.get('checksum'))
+            if row["status"] == uploads.STATUS_FINALIZED:
+                return jsonify(uploads.to_public(row))
+
+            path = row["path"]
+            try:
+                if row["received"] <= 44:
+                    raise uploads.UploadError("uploaded file too small or empty", size=row["received"])
+                if buckets is not None and getattr(g, "rate_buckets", None):
+                    extra = long_audio_cost(row["received"])
+                    if extra:
+                        buckets.charge(g.rate_buckets, extra)
+                charge_conversion(path)
+                result = predict_file(model, path, debug_mode=debug_mode, tag="uploads", invoke=scheduled_invoke(priority), cascade=request_cascade())
+            except BaseException:
+                uploads.abort_finalize(conn, upload_id)
+                raise
+            uploads.finish_finalize(conn, upload_id, path, result, ttl=UPLOAD_TTL)
+            print(f"[uploads] finalized {upload_id} pred_label={result.get('pred_label')}")
+            return jsonify(uploads.to_public(uploads.get(conn, upload_id, g.api_key_name)))
+        except uploads.UploadError as e:
+            return upload_error(e)
+        except SchedulerBusy as e:
+            return jsonify({"error": str(e), "priority": priority}), 503
         except Exception as e:
             tb = traceback.format_exc()
             return jsonify({"error": str(e), "trace": tb}), 500
         finally:
-            # cleanup temp files (both original and converted)
-            try:
-                if tmp and os.path.exists(tmp):
-                    os.remove(tmp)
-            except Exception:
-                pass
+            conn.close()
+
+
+    @app.route("/uploads/<upload_id>", methods=["DELETE"])
+    def upload_delete(upload_id):
+        conn = uploads.connect()
+        try:
+            uploads.delete(conn, upload_id, g.api_key_name)
+            return jsonify({"upload_id": upload_id, "status": "deleted"})
+        except uploads.UploadError as e:
+            return upload_error(e)
+        finally:
+            conn.close()
 
 
     @app.route("/predict_debug", methods=["POST"])
@@ -325,25 +621,12 @@ def create_app():
                 'shape': list(input_image.shape)
             }
 
-            input_q, input_meta = quantize_input(input_image, input_details[0])
-
-            interpreter.set_tensor(input_details[0]['index'], input_q)
-            interpreter.invoke()
-
-            raw_out = interpreter.get_tensor(output_details[0]['index'])
-            output_float, out_meta = dequantize_output(raw_out, output_details[0])
+            raw_out, output_float, input_meta, out_meta = scheduler.run("interactive", run_model, input_image)
 
-            arr = output_float[0]
             # detect if interpreter output is already a probability vector
-            if np.all(arr >= -1e-6) and np.all(arr <= 1.0 + 1e-6) and abs(np.sum(arr) - 1.0) < 1e-2:
-                probs = arr.tolist()
-                logits = arr.tolist()
-                prob_mode = 'probabilities'
-            else:
-                logits = arr.tolist()
-                exps = np.exp(np.array(logits) - np.max(logits))
-                probs = (exps / np.sum(exps)).tolist()
-                prob_mode = 'logits+softmax'
+            probs_arr, prob_mode = to_probabilities(output_float[0])
+            probs = probs_arr.tolist()
+            logits = output_float[0].tolist()
 
             return jsonify({
                 'input_stats': stats,
@@ -356,6 +639,8 @@ def create_app():
                 'prob_mode': prob_mode,
             })
 
+        except SchedulerBusy as e:
+            return jsonify({"error": str(e)}), 503
         except Exception as e:
             tb = traceback.format_exc()
             return jsonify({"error": str(e), "trace": tb}), 500
@@ -367,9 +652,169 @@ def create_app():
                     pass
 
 
+    if PROFILE_ADMIN_KEY:
+        profile_store = ProfileStore(os.environ.get("PROFILE_DIR"), keep=int(os.environ.get("PROFILE_KEEP", "20")))
+        profiled_endpoints = {'predict', 'predict_debug', 'submit_job', 'upload_finalize'}
+        register_profiling(app, Profiler(profile_store), PROFILE_ADMIN_KEY, profiled_endpoints)
+        print("[startup] profiling endpoints enabled at /admin/profile")
+
     return app
 
 
+def read_limited(stream, limit):
+    """Read up to `limit` bytes from a request stream."""
+    parts, remaining = [], limit
+    while remaining > 0:
+        block = stream.read(min(remaining, 1 << 16))
+        if not block:
+            break
+        parts.append(block)
+        remaining -= len(block)
+    return b"".join(parts)
+
+
+def load_api_keys():
+    """Map secret -> key name from PRED_API_KEYS ("name=secret,...") and PRED_API_KEY."""
+    keys = {}
+    for i, entry in enumerate(p.strip() for p in os.environ.get("PRED_API_KEYS", "").split(",")):
+        if not entry:
+            continue
+        name, sep, secret = entry.partition("=")
+        if not sep:
+            name, secret = f"key{i}", entry
+        if not secret.strip():
+            # an empty secret would match requests that send no key at all
+            print(f"[startup] ignoring API key {name.strip()!r} with an empty secret")
+            continue
+        keys[secret.strip()] = name.strip()
+    legacy = os.environ.get("PRED_API_KEY", "").strip()
+    if legacy:
+        keys.setdefault(legacy, "default")
+    return keys
+
+
+def register_profiling(app, profiler, admin_key, endpoints):
+    """Admin-only profiling surface. Not registered at all when PROFILE_ADMIN_KEY is unset.
+
+    Only requests to `endpoints` (the inference routes) are sampled and counted;
+    health checks and the admin's own polling would otherwise use up `requests=N`.
+    """
+    store = profiler.store
+
+    def is_admin():
+        key = request.headers.get("x-admin-key") or ""
+        return hmac.compare_digest(key.encode(), admin_key.encode())
+
+    def local_session(session_id):
+        """This process's session if it is `session_id` (default: the latest in the store)."""
+        session = profiler.session
+        if session is None:
+            return None
+        if session_id is None:
+            session_id = store.latest_id() or session.id
+        return session if session.id == session_id else None
+
+    def find_summary(session_id):
+        """Summary dict for `session_id` (default: the latest), from this process or the shared store."""
+        session = local_session(session_id)
+        if session is not None:
+            return session.summary()
+        if session_id is None:
+            session_id = store.latest_id()
+            if session_id is None:
+                return None
+        text = store.load(session_id)
+        return json.loads(text) if text else None
+
+    @app.before_request
+    def profile_request_started():
+        if profiler.active and request.endpoint in endpoints:
+            profiler.request_started()
+
+    @app.teardown_request
+    def profile_request_finished(exc=None):
+        if profiler.active and request.endpoint in endpoints:
+            profiler.request_finished()
+
+    @app.route("/admin/profile", methods=["POST"])
+    def profile_start():
+        """Start sampling the next `requests` requests or a `seconds` window."""
+        if not is_admin():
+            return jsonify({"error": "missing or invalid admin key"}), 401
+        params = dict(request.args)
+        params.update(request.get_json(silent=True) or {})
+        try:
+            session = profiler.start(
+                requests=params.get('requests'),
+                seconds=params.get('seconds'),
+                interval_ms=float(params.get('interval_ms', 5)),
+                trace_malloc=str(params.get('tracemalloc', '1')).lower() in ('1', 'true'),
+                malloc_top=int(params.get('malloc_top', 25)),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        print(f"[profile] started session {session.id} pid={os.getpid()} requests={session.requests} seconds={session.seconds}")
+        return jsonify(session.summary()), 202
+
+    @app.route("/admin/profile", methods=["GET"])
+    def profile_status():
+        """Summary of session `?id=` (default: the latest); `?format=speedscope|collapsed` downloads the profile."""
+        if not is_admin():
+            return jsonify({"error": "missing or invalid admin key"}), 401
+        try:
+            summary = find_summary(request.args.get('id'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if summary is None:
+            return jsonify({"error": "no profiling session"}), 404
+
+        fmt = request.args.get('format', 'summary')
+        if fmt == 'summary':
+            return jsonify(summary)
+        if fmt not in ('speedscope', 'collapsed'):
+            return jsonify({"error": "format must be summary, speedscope or collapsed"}), 400
+        if summary["status"] == "running":
+            return jsonify({"error": "session still running", "status": summary["status"]}), 409
+        body = store.load(summary["id"], fmt)
+        if body is None:
+            return jsonify({"error": "profile not available"}), 404
+        if fmt == 'speedscope':
+            return Response(
+                body,
+                mimetype="application/json",
+                headers={"Content-Disposition": f"attachment; filename=profile-{summary['id']}.speedscope.json"},
+            )
+        return Response(
+            body,
+            mimetype="text/plain",
+            headers={"Content-Disposition": f"attachment; filename=profile-{summary['id']}.folded"},
+        )
+
+    @app.route("/admin/profile", methods=["DELETE"])
+    def profile_stop():
+        """Stop the running session (`?id=`, default: the latest) early."""
+        if not is_admin():
+            return jsonify({"error": "missing or invalid admin key"}), 401
+        session_id = request.args.get('id')
+        try:
+            session = local_session(session_id)
+            if session is not None:
+                session.stop()
+                return jsonify(session.summary())
+            summary = find_summary(session_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if summary is None:
+            return jsonify({"error": "no profiling session"}), 404
+        if summary["status"] == "running":
+            # owned by another server process; its sampler picks this up shortly
+            store.request_stop(summary["id"])
+            return jsonify(dict(summary, stop_requested=True)), 202
+        return jsonify(summary)
+
+
 if __name__ == "__main__":
     app = create_app()
     # bind to 0.0.0.0 so mobile devices on the same LAN can reach the dev server
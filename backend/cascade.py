@@ -0,0 +1,232 @@
+"""Early-exit cascade in front of the full int8 model.
+
+Cheap stages look at the mel image that `audio_to_mel_image` already produced
+and either answer confidently or escalate. Only escalated requests pay for
+`interpreter.invoke()` on the full model.
+
+The 24 labels are 12 sound events x {speech, no_speech}. The template stage
+scores the two factors separately (which event, is there speech) and combines
+them, so each template sees far more training clips than one per label would.
+
+Stages are plain objects with a `name` and `predict(input_image)` returning
+(probs over class_names, confidence). Enable them with `CASCADE_STAGES`, e.g.
+"template" or "template,tflite"; see `cascade_eval.py` to fit templates and
+pick thresholds.
+"""
+import os
+import threading
+import numpy as np
+
+from inference import run_model, to_probabilities
+
+
+SPEECH_SUFFIX = "_speech"
+NO_SPEECH_SUFFIX = "_no_speech"
+
+DEFAULT_ESCALATE_EVENTS = "glass_breaking,gun_shot,crying"
+
+
+def split_label(label):
+    """"dog_barking_no_speech" -> ("dog_barking", "no_speech")."""
+    if label.endswith(NO_SPEECH_SUFFIX):
+        return label[:-len(NO_SPEECH_SUFFIX)], "no_speech"
+    if label.endswith(SPEECH_SUFFIX):
+        return label[:-len(SPEECH_SUFFIX)], "speech"
+    return label, None
+
+
+def label_factors(class_names):
+    """Return (events, speech values, [(event_idx, speech_idx)] per class)."""
+    events, speech = [], []
+    pairs = []
+    for label in class_names:
+        event, sp = split_label(label)
+        if event not in events:
+            events.append(event)
+        if sp not in speech:
+            speech.append(sp)
+        pairs.append((events.index(event), speech.index(sp)))
+    return events, speech, pairs
+
+
+def template_features(input_image):
+    """Per-band mean and std of the log-mel image over time: 2 * n_mels values."""
+    mel = np.asarray(input_image, dtype=np.float32).reshape(input_image.shape[1], -1)
+    return np.concatenate([mel.mean(axis=1), mel.std(axis=1)])
+
+
+def _softmax(x):
+    e = np.exp(x - np.max(x))
+    return e / np.sum(e)
+
+
+def fit_templates(features, labels, class_names):
+    """Fit factorized nearest-centroid templates.
+
+    `features` is (n, d) from `template_features`, `labels` the class index of
+    each row. Returns a dict that can be saved with `np.savez`.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    labels = np.asarray(labels)
+    events, speech, pairs = label_factors(class_names)
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    z = (features - mean) / std
+
+    event_of = np.array([pairs[i][0] for i in labels])
+    speech_of = np.array([pairs[i][1] for i in labels])
+    event_centroids = np.stack([
+        z[event_of == e].mean(axis=0) if np.any(event_of == e) else np.full(z.shape[1], np.inf)
+        for e in range(len(events))
+    ])
+    speech_centroids = np.stack([
+        z[speech_of == s].mean(axis=0) if np.any(speech_of == s) else np.full(z.shape[1], np.inf)
+        for s in range(len(speech))
+    ])
+
+    # softmax temperature: typical squared distance to the own centroid
+    def temperature(centroids, of):
+        d = np.sum((z - centroids[of]) ** 2, axis=1)
+        return float(np.median(d)) or 1.0
+
+    return {
+        "class_names": np.array(class_names),
+        "mean": mean,
+        "std": std,
+        "event_centroids": event_centroids,
+        "speech_centroids": speech_centroids,
+        "event_temperature": np.float32(temperature(event_centroids, event_of)),
+        "speech_temperature": np.float32(temperature(speech_centroids, speech_of)),
+    }
+
+
+class TemplateStage:
+    """Spectral-template classifier: a couple of dot products instead of a CNN."""
+
+    name = "template"
+
+    def __init__(self, templates, class_names, threshold=0.9):
+        saved = [str(c) for c in templates["class_names"]]
+        if saved != list(class_names):
+            raise ValueError("cascade templates were fitted for different class_names")
+        self.class_names = list(class_names)
+        self.threshold = float(threshold)
+        self.mean = np.asarray(templates["mean"], dtype=np.float32)
+        self.std = np.asarray(templates["std"], dtype=np.float32)
+        self.event_centroids = np.asarray(templates["event_centroids"], dtype=np.float32)
+        self.speech_centroids = np.asarray(templates["speech_centroids"], dtype=np.float32)
+        self.event_temperature = float(templates["event_temperature"])
+        self.speech_temperature = float(templates["speech_temperature"])
+        _, _, self.pairs = label_factors(self.class_names)
+
+    @classmethod
+    def load(cls, path, class_names, threshold=0.9):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({k: data[k] for k in data.files}, class_names, threshold)
+
+    def scores(self, input_image):
+        """Probabilities over class_names as p(event) * p(speech)."""
+        z = (template_features(input_image) - self.mean) / self.std
+        p_event = _softmax(-np.sum((self.event_centroids - z) ** 2, axis=1) / self.event_temperature)
+        p_speech = _softmax(-np.sum((self.speech_centroids - z) ** 2, axis=1) / self.speech_temperature)
+        return np.array([p_event[e] * p_speech[s] for e, s in self.pairs], dtype=float)
+
+    def predict(self, input_image):
+        probs = self.scores(input_image)
+        return probs, float(np.max(probs))
+
+
+class TFLiteStage:
+    """A smaller secondary TFLite model with the same input and 24 outputs."""
+
+    name = "tflite"
+
+    def __init__(self, model_path, threshold=0.9):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        interpreter = Interpreter(model_path=model_path)
+        interpreter.allocate_tensors()
+        self.model = {
+            'interpreter': interpreter,
+            'input_details': interpreter.get_input_details(),
+            'output_details': interpreter.get_output_details(),
+        }
+        self.threshold = float(threshold)
+        # the full model's interpreter is protected by the scheduler; this one is ours
+        self._lock = threading.Lock()
+
+    def predict(self, input_image):
+        with self._lock:
+            _, output_float, _, _ = run_model(self.model, input_image)
+        probs, _ = to_probabilities(output_float[0])
+        return probs, float(np.max(probs))
+
+
+class Cascade:
+    def __init__(self, stages, class_names, escalate_events=()):
+        self.stages = list(stages)
+        self.class_names = list(class_names)
+        self.escalate_events = set(escalate_events)
+        self._lock = threading.Lock()
+        self._answered = {s.name: 0 for s in self.stages}
+        self._escalated = 0
+        self._guarded = 0
+
+    def try_answer(self, input_image):
+        """Return (probs, info) from the first confident stage, or (None, info) to escalate."""
+        info = {"stages": []}
+        for stage in self.stages:
+            probs, confidence = stage.predict(input_image)
+            label = self.class_names[int(np.argmax(probs))]
+            info["stages"].append({"stage": stage.name, "label": label, "confidence": confidence})
+            if confidence < stage.threshold:
+                continue
+            if split_label(label)[0] in self.escalate_events:
+                # safety-critical events are always confirmed by the full model
+                with self._lock:
+                    self._guarded += 1
+                break
+            with self._lock:
+                self._answered[stage.name] += 1
+            info["answered_by"] = stage.name
+            return probs, info
+        with self._lock:
+            self._escalated += 1
+        info["answered_by"] = "full_model"
+        return None, info
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._answered.values()) + self._escalated
+            return {
+                "stages": [{"stage": s.name, "threshold": s.threshold} for s in self.stages],
+                "escalate_events": sorted(self.escalate_events),
+                "answered": dict(self._answered),
+                "escalated": self._escalated,
+                "escalated_safety_critical": self._guarded,
+                "early_exit_rate": (sum(self._answered.values()) / total) if total else None,
+            }
+
+
+def load_cascade(project_root, class_names):
+    """Build the cascade from CASCADE_* env vars, or return None when disabled."""
+    names = [n.strip() for n in os.environ.get("CASCADE_STAGES", "").split(",") if n.strip()]
+    if not names:
+        return None
+    stages = []
+    for name in names:
+        if name == "template":
+            path = os.environ.get("CASCADE_TEMPLATES", os.path.join(project_root, "contexts", "cascade_templates.npz"))
+            stages.append(TemplateStage.load(path, class_names, float(os.environ.get("CASCADE_TEMPLATE_THRESHOLD", "0.9"))))
+        elif name == "tflite":
+            path = os.environ.get("CASCADE_TFLITE_MODEL")
+            if not path:
+                raise ValueError("CASCADE_TFLITE_MODEL is required for the tflite cascade stage")
+            stages.append(TFLiteStage(path, float(os.environ.get("CASCADE_TFLITE_THRESHOLD", "0.9"))))
+        else:
+            raise ValueError(f"unknown cascade stage {name!r}")
+    escalate = [e.strip() for e in os.environ.get("CASCADE_ESCALATE_EVENTS", DEFAULT_ESCALATE_EVENTS).split(",") if e.strip()]
+    return Cascade(stages, class_names, escalate_events=escalate)
@@ -0,0 +1,248 @@
+"""Evaluate the early-exit cascade on the clips in contexts/audio.
+
+For every clip the full model and the cheap stage(s) are run, then a table is
+printed with, per confidence threshold: how many requests the cascade would
+answer early, accuracy of those early answers, overall accuracy (early answers
++ full model for the rest, also split into event and speech/no_speech), the
+recall of safety-critical events and the estimated compute saved versus always
+running the full model.
+
+Safety recall: the escalate events are never answered early under their own
+label, but a true glass_breaking clip that the cheap stage confidently calls
+dog_barking still exits early, and the full model never sees it. `missed` counts
+those clips, and `escalate_recall` is the share of true escalate-event clips
+that were escalated rather than answered early as another event.
+
+Each stage is scored on its own, and with `--tflite` also as the pipeline
+`CASCADE_STAGES=template,tflite` runs it: stages in order, the first confident
+stage answers, escalate events go to the full model. The rows are computed by
+replaying the recorded stage outputs through `cascade.Cascade` itself.
+
+Template scores are cross-validated: clips are split into folds by source
+recording id (the leading number in the filename), so segments of one
+recording never appear in both the fitted templates and the evaluated clips.
+
+Usage:
+
+    python cascade_eval.py                       # evaluate, print table
+    python cascade_eval.py --fit                 # also write contexts/cascade_templates.npz
+    python cascade_eval.py --tflite small.tflite # evaluate a secondary model stage as well
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import numpy as np
+
+from inference import load_model, run_model, to_probabilities
+from cascade import (
+    DEFAULT_ESCALATE_EVENTS, Cascade, TemplateStage, TFLiteStage,
+    fit_templates, split_label, template_features,
+)
+
+
+def collect_clips(audio_dir, class_names):
+    clips = []
+    for label in sorted(os.listdir(audio_dir)):
+        d = os.path.join(audio_dir, label)
+        if not os.path.isdir(d) or label not in class_names:
+            continue
+        for name in sorted(os.listdir(d)):
+            if name.lower().endswith(".wav"):
+                clips.append((os.path.join(d, name), class_names.index(label)))
+    return clips
+
+
+def recording_fold(path, folds):
+    recording = os.path.basename(path).split("_")[0]
+    return zlib.crc32(recording.encode()) % folds
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - start) * 1000.0
+
+
+class ReplayStage:
+    """Cascade stage that returns outputs precomputed for a record, so the sweep
+    runs the production `Cascade.try_answer` logic without re-running models."""
+
+    def __init__(self, name, threshold):
+        self.name = name
+        self.threshold = float(threshold)
+
+    def predict(self, record):
+        probs = record[self.name]
+        return probs, float(np.max(probs))
+
+
+def evaluate(records, class_names, thresholds, escalate_events, stage_keys):
+    """Sweep thresholds for the stages `stage_keys`, run in order like `CASCADE_STAGES`.
+
+    `records` hold the true label, full-model and per-stage outputs and timings.
+    A threshold is either one value shared by all stages or a {stage: threshold} dict.
+    """
+    n = len(records)
+    full_ms = float(np.mean([r["full_ms"] for r in records]))
+    stage_ms = {k: float(np.mean([r[k + "_ms"] for r in records])) for k in stage_keys}
+    critical = sum(split_label(class_names[r["label"]])[0] in escalate_events for r in records)
+    rows = []
+    for t in thresholds:
+        per_stage = dict(t) if isinstance(t, dict) else {k: t for k in stage_keys}
+        cascade = Cascade([ReplayStage(k, per_stage[k]) for k in stage_keys], class_names, escalate_events)
+        early = correct = correct_event = correct_speech = early_correct = agree = missed = 0
+        cost = 0.0
+        for r in records:
+            probs, info = cascade.try_answer(r)
+            # every stage that ran costs its time, even if it escalated
+            cost += sum(r[st["stage"] + "_ms"] for st in info["stages"])
+            true_event, true_speech = split_label(class_names[r["label"]])
+            if probs is not None:
+                idx = int(np.argmax(probs))
+                early += 1
+                early_correct += int(idx == r["label"])
+                agree += int(idx == r["full_idx"])
+                # a safety-critical clip answered early as some other event
+                missed += int(true_event in escalate_events)
+            else:
+                idx = r["full_idx"]
+                cost += r["full_ms"]
+            correct += int(idx == r["label"])
+            pred_event, pred_speech = split_label(class_names[idx])
+            correct_event += int(pred_event == true_event)
+            correct_speech += int(pred_speech == true_speech)
+        cost /= n
+        rows.append({
+            "threshold": per_stage,
+            "early_exit": early / n,
+            "answered_by": cascade.stats()["answered"],
+            "early_accuracy": (early_correct / early) if early else None,
+            "early_agreement": (agree / early) if early else None,
+            "accuracy": correct / n,
+            "event_accuracy": correct_event / n,
+            "speech_accuracy": correct_speech / n,
+            "escalate_missed": missed,
+            "escalate_recall": (1.0 - missed / critical) if critical else None,
+            "ms_per_request": cost,
+            "compute_saved": 1.0 - cost / full_ms if full_ms else None,
+        })
+    return {
+        "stage": "+".join(stage_keys), "stage_ms": stage_ms, "full_ms": full_ms,
+        "escalate_clips": critical, "rows": rows,
+    }
+
+
+def print_report(report, full_accuracy):
+    stage_ms = ", ".join(f"{k} {v:.2f}" for k, v in report["stage_ms"].items())
+    print(f"\n== stage: {report['stage']}  (ms/clip: {stage_ms}, full model {report['full_ms']:.2f}; "
+          f"full-model accuracy {full_accuracy:.3f}, {report['escalate_clips']} escalate-event clips)")
+    print(f"{'thresh':>11} {'early%':>7} {'early_acc':>9} {'agree':>6} {'acc':>6} {'event':>6} {'speech':>6} "
+          f"{'esc_rec':>7} {'missed':>6} {'ms/req':>7} {'saved%':>7}")
+    fmt = lambda v, w, p=3: f"{v:>{w}.{p}f}" if v is not None else f"{'-':>{w}}"
+    for r in report["rows"]:
+        thresh = "/".join(f"{v:.2f}" for v in r["threshold"].values())
+        print(f"{thresh:>11} {100 * r['early_exit']:>6.1f}% {fmt(r['early_accuracy'], 9)} {fmt(r['early_agreement'], 6)} "
+              f"{r['accuracy']:>6.3f} {r['event_accuracy']:>6.3f} {r['speech_accuracy']:>6.3f} "
+              f"{fmt(r['escalate_recall'], 7)} {r['escalate_missed']:>6d} {r['ms_per_request']:>7.2f} "
+              f"{fmt(None if r['compute_saved'] is None else 100 * r['compute_saved'], 6, 1)}%")
+
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Evaluate the early-exit cascade on labelled clips")
+    parser.add_argument("--audio-dir", default=os.path.join(project_root, "contexts", "audio"))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.85,0.9,0.95,0.98,0.99")
+    parser.add_argument("--escalate-events", default=os.environ.get("CASCADE_ESCALATE_EVENTS", DEFAULT_ESCALATE_EVENTS),
+                        help="events always confirmed by the full model (comma-separated, empty for none)")
+    parser.add_argument("--tflite", help="secondary TFLite model to evaluate as a cascade stage")
+    parser.add_argument("--fit", action="store_true", help="fit templates on all clips and save them to --out")
+    parser.add_argument("--out", default=os.path.join(project_root, "contexts", "cascade_templates.npz"))
+    parser.add_argument("--json", help="also write the full report as JSON to this path")
+    args = parser.parse_args(argv)
+    if args.folds < 2:
+        parser.error("--folds must be at least 2 (templates are scored on held-out recordings)")
+
+    thresholds = [float(t) for t in args.thresholds.split(",") if t.strip()]
+    escalate_events = {e.strip() for e in args.escalate_events.split(",") if e.strip()}
+
+    model = load_model(project_root)
+    class_names = list(model["class_names"])
+    clips = collect_clips(args.audio_dir, class_names)
+    if not clips:
+        print(f"No labelled .wav clips found under {args.audio_dir}")
+        sys.exit(2)
+    print(f"Evaluating {len(clips)} clips from {args.audio_dir}")
+
+    secondary = TFLiteStage(args.tflite) if args.tflite else None
+    records, features = [], []
+    for path, label in clips:
+        try:
+            input_image = model["audio_to_mel_image"](path)
+        except Exception as e:
+            print(f"  skipping {path}: {e}")
+            continue
+        (_, output_float, _, _), full_ms = timed(run_model, model, input_image)
+        probs, _ = to_probabilities(output_float[0])
+        record = {
+            "path": path, "label": label, "image": input_image,
+            "full_idx": int(np.argmax(probs)), "full_ms": full_ms,
+            "fold": recording_fold(path, args.folds),
+        }
+        if secondary is not None:
+            (record["tflite"], _), record["tflite_ms"] = timed(secondary.predict, input_image)
+        records.append(record)
+        features.append(template_features(input_image))
+    features = np.stack(features)
+    labels = np.array([r["label"] for r in records])
+
+    # cross-validated template scores
+    for fold in range(args.folds):
+        test = [i for i, r in enumerate(records) if r["fold"] == fold]
+        train = [i for i, r in enumerate(records) if r["fold"] != fold]
+        if not test or not train:
+            continue
+        stage = TemplateStage(fit_templates(features[train], labels[train], class_names), class_names)
+        for i in test:
+            records[i]["template"], score_ms = timed(stage.scores, records[i]["image"])
+            # the stage recomputes features from the image, so its timing already includes them
+            records[i]["template_ms"] = score_ms
+    records = [r for r in records if "template" in r]
+    if not records:
+        print(f"No clip could be scored: every fold lacked training or test clips. "
+              f"Add recordings or lower --folds (currently {args.folds}).")
+        sys.exit(2)
+
+    full_accuracy = float(np.mean([r["full_idx"] == r["label"] for r in records]))
+    reports = [evaluate(records, class_names, thresholds, escalate_events, ["template"])]
+    if secondary is not None:
+        reports.append(evaluate(records, class_names, thresholds, escalate_events, ["tflite"]))
+        # the pipeline as CASCADE_STAGES=template,tflite runs it: the shared sweep,
+        # then the thresholds currently configured in the environment
+        configured = {
+            "template": float(os.environ.get("CASCADE_TEMPLATE_THRESHOLD", "0.9")),
+            "tflite": float(os.environ.get("CASCADE_TFLITE_THRESHOLD", "0.9")),
+        }
+        reports.append(evaluate(records, class_names, thresholds + [configured], escalate_events, ["template", "tflite"]))
+    for report in reports:
+        print_report(report, full_accuracy)
+    print("\nthresh = per-stage thresholds in stage order; early% = requests answered without the full model; "
+          "agree = early answers matching the full model; "
+          "esc_rec = share of escalate-event clips sent to the full model; missed = escalate-event clips answered "
+          "early as another event; saved% = estimated inference compute saved vs full model only.")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"clips": len(records), "full_accuracy": full_accuracy, "reports": reports}, fh, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.fit:
+        np.savez(args.out, **fit_templates(features, labels, class_names))
+        print(f"Wrote templates fitted on {len(records)} clips to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
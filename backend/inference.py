@@ -0,0 +1,252 @@
+import os
+import shutil
+import subprocess
+import importlib.util
+import numpy as np
+
+
+def load_pred_module(project_root):
+    pred_path = os.path.join(project_root, "contexts", "pred_with_audio.py")
+    spec = importlib.util.spec_from_file_location("pred_with_audio", pred_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_model(project_root):
+    """Load preprocessing helpers, class names and the TFLite interpreter.
+
+    Returns a dict so the Flask app and the job workers share the same setup.
+    """
+    pred_mod = load_pred_module(project_root)
+
+    # Try to reuse interpreter loaded by pred_with_audio.py if present
+    interpreter = getattr(pred_mod, "interpreter", None)
+    input_details = getattr(pred_mod, "input_details", None)
+    output_details = getattr(pred_mod, "output_details", None)
+
+    if interpreter is None:
+        import tensorflow as tf
+        model_path = os.path.join(project_root, "contexts", "model_int8.tflite")
+        interpreter = tf.lite.Interpreter(model_path=model_path)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+
+    return {
+        'audio_to_mel_image': getattr(pred_mod, "audio_to_mel_image"),
+        'class_names': getattr(pred_mod, "class_names"),
+        'interpreter': interpreter,
+        'input_details': input_details,
+        'output_details': output_details,
+    }
+
+
+def quantize_input(image: np.ndarray, detail: dict):
+    q = detail.get('quantization', (0.0, 0))
+    scale, zero_point = q if q is not None else (0.0, 0)
+    dtype = detail.get('dtype', None)
+
+    if not scale or scale == 0:
+        return image.astype(np.float32), {
+            'mode': 'float', 'scale': scale, 'zero_point': zero_point, 'dtype': str(dtype)
+        }
+
+    qdata = np.round(image / scale) + zero_point
+    qstr = str(dtype).lower() if dtype is not None else ''
+    if 'uint8' in qstr:
+        qdata = np.clip(qdata, 0, 255).astype(np.uint8)
+    elif 'int8' in qstr:
+        qdata = np.clip(qdata, -128, 127).astype(np.int8)
+    else:
+        qdata = qdata.astype(np.int32)
+
+    return qdata, {'mode': 'quant', 'scale': float(scale), 'zero_point': int(zero_point), 'dtype': str(dtype)}
+
+
+def dequantize_output(out_tensor: np.ndarray, detail: dict):
+    q = detail.get('quantization', (0.0, 0))
+    scale, zero_point = q if q is not None else (0.0, 0)
+    if not scale or scale == 0:
+        return out_tensor.astype(np.float32), {'mode': 'float', 'scale': scale, 'zero_point': zero_point}
+    return scale * (out_tensor.astype(np.float32) - zero_point), {'mode': 'dequant', 'scale': float(scale), 'zero_point': int(zero_point)}
+
+
+def read_header_preview(path, n=128):
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read(n).hex()
+    except Exception:
+        return None
+
+
+def convert_with_ffmpeg(src, tag="predict"):
+    """Convert `src` to 16 kHz mono WAV. Returns the new path or None on failure."""
+    ffmpeg_path = shutil.which('ffmpeg')
+    if not ffmpeg_path:
+        print(f"[{tag}] ffmpeg not found on PATH; cannot convert non-WAV uploads")
+        return None
+    tmp_wav = src + '.converted.wav'
+    cmd = [ffmpeg_path, '-y', '-i', src, '-ar', '16000', '-ac', '1', tmp_wav]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    print(f"[{tag}] ffmpeg rc={proc.returncode} stdout={proc.stdout[:200]} stderr={proc.stderr[:200]}")
+    if proc.returncode == 0 and os.path.exists(tmp_wav):
+        return tmp_wav
+    print(f"[{tag}] ffmpeg conversion failed for {src}: rc={proc.returncode}")
+    return None
+
+
+def load_input_image(model, path, tag="predict"):
+    """Decode `path` (converting with ffmpeg when needed) into a mel image.
+
+    Returns (input_image, header_preview, converted_path). `converted_path` is
+    the ffmpeg output (if any) so callers can clean it up.
+    """
+    audio_to_mel_image = model['audio_to_mel_image']
+    header_preview = read_header_preview(path)
+
+    # If header doesn't start with RIFF (52494646), try converting with ffmpeg.
+    # Many mobile/web recordings use WebM/Opus or other containers which librosa may not decode directly.
+    converted = None
+    if not (header_preview and header_preview.startswith('52494646')):
+        converted = convert_with_ffmpeg(path, tag)
+        if converted is not None:
+            header_preview = read_header_preview(converted) or header_preview
+
+    # prefer converted file if available
+    use_path = converted if converted is not None else path
+
+    try:
+        input_image = audio_to_mel_image(use_path)
+    except Exception as e:
+        print(f"[{tag}] audio_to_mel_image failed for {use_path}: {e}")
+        # if we haven't tried conversion yet, and ffmpeg exists, try now
+        if converted is None and shutil.which('ffmpeg'):
+            converted = convert_with_ffmpeg(path, tag)
+            if converted is None:
+                raise RuntimeError("ffmpeg conversion failed")
+            input_image = audio_to_mel_image(converted)
+        else:
+            raise RuntimeError(f"audio_to_mel_image failed and conversion not available: {e}")
+
+    return input_image, header_preview, converted
+
+
+def run_model(model, input_image):
+    """Quantize, invoke the interpreter and return (raw_out, output_float, input_meta, out_meta)."""
+    interpreter = model['interpreter']
+    input_details = model['input_details']
+    output_details = model['output_details']
+
+    input_q, input_meta = quantize_input(input_image, input_details[0])
+
+    interpreter.set_tensor(input_details[0]['index'], input_q)
+    interpreter.invoke()
+
+    raw_out = interpreter.get_tensor(output_details[0]['index'])
+    output_float, out_meta = dequantize_output(raw_out, output_details[0])
+    return raw_out, output_float, input_meta, out_meta
+
+
+def to_probabilities(arr):
+    """Return (probs, prob_mode) for a single output row."""
+    # output may already be probabilities (model exported with softmax)
+    if np.all(arr >= -1e-6) and np.all(arr <= 1.0 + 1e-6) and abs(np.sum(arr) - 1.0) < 1e-2:
+        return arr.astype(float), 'probabilities'
+    exps = np.exp(arr - np.max(arr))
+    return (exps / np.sum(exps)).astype(float), 'logits+softmax'
+
+
+def build_result(class_names, probs, prob_mode):
+    probs_list = probs.tolist()
+    scores_map = {class_names[i]: float(probs_list[i]) for i in range(min(len(class_names), len(probs_list)))}
+    top_k_idx = np.argsort(probs)[::-1][:3]
+    top_k = [{"label": class_names[int(i)], "score": float(probs_list[int(i)])} for i in top_k_idx]
+
+    pred_idx = int(np.argmax(probs))
+    pred_label = class_names[pred_idx] if 0 <= pred_idx < len(class_names) else str(pred_idx)
+
+    return {
+        "pred_idx": pred_idx,
+        "pred_label": pred_label,
+        "scores": probs_list,
+        "scores_map": scores_map,
+        "top_k": top_k,
+        "prob_mode": prob_mode,
+    }
+
+
+def predict_file(model, path, debug_mode=False, tag="predict", invoke=None, cascade=None):
+    """Full decode -> audio_to_mel_image -> interpreter pipeline for one file.
+
+    Used by `/predict` and by the job workers so both return the same payload.
+    `invoke(input_image)` replaces the direct `run_model` call, e.g. to route
+    the interpreter step through the priority scheduler. When a `cascade` is
+    given its cheap stages may answer before the full model is invoked.
+    """
+    class_names = model['class_names']
+    converted = None
+    try:
+        input_image, header_preview, converted = load_input_image(model, path, tag)
+
+        # collect basic stats for debugging
+        try:
+            input_stats = {
+                'min': float(np.min(input_image)),
+                'max': float(np.max(input_image)),
+                'mean': float(np.mean(input_image)),
+                'std': float(np.std(input_image)),
+                'shape': list(input_image.shape)
+            }
+        except Exception:
+            input_stats = None
+
+        cascade_info = None
+        if cascade is not None:
+            early_probs, cascade_info = cascade.try_answer(input_image)
+            if early_probs is not None:
+                result = build_result(class_names, early_probs, f"cascade:{cascade_info['answered_by']}")
+                result["header_preview"] = header_preview
+                result["cascade"] = cascade_info
+                if debug_mode:
+                    result.update({'input_stats': input_stats, 'class_names_len': len(class_names)})
+                print(f"[{tag}] result pred_label={result['pred_label']} answered_by={cascade_info['answered_by']}")
+                return result
+
+        if invoke is None:
+            raw_out, output_float, input_meta, out_meta = run_model(model, input_image)
+        else:
+            raw_out, output_float, input_meta, out_meta = invoke(input_image)
+        probs, prob_mode = to_probabilities(output_float[0])
+
+        result = build_result(class_names, probs, prob_mode)
+        result["header_preview"] = header_preview
+        if cascade_info is not None:
+            result["cascade"] = cascade_info
+
+        # when debug mode requested, add internals so we can inspect why 'unknown' appears
+        if debug_mode:
+            try:
+                result.update({
+                    'input_stats': input_stats,
+                    'input_meta': input_meta,
+                    'output_meta': out_meta,
+                    'raw_output': raw_out.tolist(),
+                    'logits': output_float[0].tolist(),
+                    'class_names_len': len(class_names),
+                })
+                print(f"[{tag}] debug result included (input shape={input_stats.get('shape') if input_stats else 'n/a'})")
+            except Exception:
+                pass
+        try:
+            pred_idx = result['pred_idx']
+            print(f"[{tag}] result pred_label={result['pred_label']} pred_idx={pred_idx} top1_score={result['scores'][pred_idx] if 0<=pred_idx<len(result['scores']) else None}")
+        except Exception:
+            pass
+        return result
+    finally:
+        if converted and os.path.exists(converted):
+            try:
+                os.remove(converted)
+            except Exception:
+                pass
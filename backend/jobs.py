@@ -0,0 +1,227 @@
+"""SQLite-backed durable job queue shared by the Flask app and `worker.py`.
+
+The web tier only spools the upload and inserts a row; worker processes claim
+rows, run the inference pipeline and write the JSON result back.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+
+from scheduler import PRIORITIES, priority_rank
+
+
+DEFAULT_JOBS_DIR = os.path.join(tempfile.gettempdir(), "soundaware_jobs")
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def jobs_dir():
+    d = os.environ.get("JOBS_DIR", DEFAULT_JOBS_DIR)
+    os.makedirs(os.path.join(d, "uploads"), exist_ok=True)
+    return d
+
+
+def db_path():
+    return os.environ.get("JOBS_DB", os.path.join(jobs_dir(), "jobs.sqlite3"))
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or db_path(), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets the web tier read job status while workers write results
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            path TEXT NOT NULL,
+            filename TEXT,
+            debug INTEGER NOT NULL DEFAULT 0,
+            priority INTEGER NOT NULL DEFAULT 2,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            worker TEXT,
+            owner TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT
+        )
+        """
+    )
+    # databases created before priorities existed
+    columns = [r["name"] for r in conn.execute("PRAGMA table_info(jobs)").fetchall()]
+    if "priority" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 2")
+    if "owner" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_priority_created ON jobs (status, priority, created_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+    return conn
+
+
+def spool_path(suffix=".wav"):
+    """Return a fresh path inside the jobs upload dir for an incoming file."""
+    return os.path.join(jobs_dir(), "uploads", uuid.uuid4().hex + (suffix or ".wav"))
+
+
+def enqueue(conn, path, filename=None, debug=False, priority="bulk", owner=None):
+    job_id = uuid.uuid4().hex
+    conn.execute(
+        "INSERT INTO jobs (id, status, path, filename, debug, priority, owner, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job_id, STATUS_QUEUED, path, filename, 1 if debug else 0, priority_rank(priority), owner, time.time()),
+    )
+    return job_id
+
+
+def claim(conn, worker_id, max_priority="bulk"):
+    """Atomically move the next queued job to running. Returns a dict or None.
+
+    Jobs are claimed highest priority first, oldest first within a priority.
+    Jobs of a lower class than `max_priority` are left in the queue.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? AND priority <= ? ORDER BY priority, created_at LIMIT 1",
+            (STATUS_QUEUED, priority_rank(max_priority)),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, started_at = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+            (STATUS_RUNNING, time.time(), worker_id, row["id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return dict(row)
+
+
+def complete(conn, job_id, worker_id, result):
+    """Record a result. Returns False if the job is no longer ours (it was requeued)."""
+    cur = conn.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, result = ? WHERE id = ? AND worker = ? AND status = ?",
+        (STATUS_DONE, time.time(), json.dumps(result), job_id, worker_id, STATUS_RUNNING),
+    )
+    return cur.rowcount == 1
+
+
+def fail(conn, job_id, worker_id, error):
+    """Record a failure. Returns False if the job is no longer ours (it was requeued)."""
+    cur = conn.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ? AND worker = ? AND status = ?",
+        (STATUS_FAILED, time.time(), str(error), job_id, worker_id, STATUS_RUNNING),
+    )
+    return cur.rowcount == 1
+
+
+def requeue_stale(conn, stale_seconds, max_attempts=3):
+    """Return jobs of dead workers to the queue; fail those that already used `max_attempts`.
+
+    A running job is stale when its worker has not sent a heartbeat for
+    `stale_seconds`, so a slow job on a live worker is never handed out twice.
+    Returns the number of requeued jobs.
+    """
+    cutoff = time.time() - stale_seconds
+    stale = (
+        "status = ? AND started_at < ? AND NOT EXISTS "
+        "(SELECT 1 FROM workers WHERE workers.id = jobs.worker AND workers.last_seen >= ?)"
+    )
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exhausted = conn.execute(
+            f"SELECT id, path FROM jobs WHERE {stale} AND attempts >= ?",
+            (STATUS_RUNNING, cutoff, cutoff, max_attempts),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = 'worker timed out' WHERE id = ?",
+            [(STATUS_FAILED, time.time(), row["id"]) for row in exhausted],
+        )
+        cur = conn.execute(
+            f"UPDATE jobs SET status = ?, worker = NULL WHERE {stale}",
+            (STATUS_QUEUED, STATUS_RUNNING, cutoff, cutoff),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    # nobody will run these again; drop their spooled uploads
+    for row in exhausted:
+        remove_spool(row["path"])
+    return cur.rowcount
+
+
+def remove_spool(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def heartbeat(conn, worker_id):
+    conn.execute(
+        "INSERT INTO workers (id, last_seen) VALUES (?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen",
+        (worker_id, time.time()),
+    )
+
+
+def live_workers(conn, max_age_seconds):
+    """Number of workers that checked in within the last `max_age_seconds`."""
+    cutoff = time.time() - max_age_seconds
+    conn.execute("DELETE FROM workers WHERE last_seen < ?", (cutoff - 3600,))
+    row = conn.execute("SELECT COUNT(*) FROM workers WHERE last_seen >= ?", (cutoff,)).fetchone()
+    return int(row[0])
+
+
+def get(conn, job_id, owner):
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    # other keys' jobs are indistinguishable from missing ones
+    if row is None or row["owner"] != owner:
+        return None
+    return to_public(dict(row))
+
+
+def queue_depth(conn):
+    row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (STATUS_QUEUED,)).fetchone()
+    return int(row[0])
+
+
+def to_public(job):
+    out = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job.get("filename"),
+        "priority": PRIORITIES[job["priority"]] if job.get("priority") is not None else None,
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "attempts": job.get("attempts"),
+    }
+    if job.get("result"):
+        out["result"] = json.loads(job["result"])
+    if job.get("error"):
+        out["error"] = job["error"]
+    return out
+
+
+def purge_finished(conn, older_than_seconds):
+    """Delete finished/failed rows older than the retention window."""
+    cutoff = time.time() - older_than_seconds
+    cur = conn.execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+        (STATUS_DONE, STATUS_FAILED, cutoff),
+    )
+    return cur.rowcount
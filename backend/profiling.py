@@ -0,0 +1,420 @@
+"""On-demand sampling profiler for the Flask app.
+
+A session samples the Python stacks of threads that are handling a request,
+either for the next N requests or for a time window. Samples are attributed to
+coarse categories (librosa, ffmpeg subprocess wait, interpreter.invoke, ...),
+exported as speedscope JSON or folded stacks for flamegraph.pl, and GC pauses
+and tracemalloc allocation hot spots are recorded alongside.
+
+Nothing here runs unless a session is started: no sampler thread, no GC
+callback and no tracemalloc.
+
+Sessions run inside one server process, but their reports are written to a
+`ProfileStore` directory shared by all processes, so any gunicorn worker can
+serve them by session id.
+"""
+import gc
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+
+
+# leaf-to-root: the first frame that matches decides the category
+CATEGORY_RULES = (
+    ("interpreter.invoke", lambda f, n: n == "invoke" and ("tensorflow" in f or "tflite" in f)),
+    ("scheduler_wait", lambda f, n: f.endswith("scheduler.py") and n == "slot"),
+    ("ffmpeg", lambda f, n: os.path.basename(f) == "subprocess.py"),
+    ("librosa", lambda f, n: "librosa" in f or "audioread" in f or "soundfile" in f),
+    ("flask_json", lambda f, n: "flask" in f or "werkzeug" in f or os.path.basename(os.path.dirname(f)) == "json"),
+)
+
+# the backend's own code; Flask frames root-side of it are just the request dispatch
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MAX_INTERVAL_MS = 1000.0
+MAX_WINDOW_SECONDS = 600.0
+MAX_REQUESTS = 1000
+STOP_CHECK_SECONDS = 0.25
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def categorize(stack, app_dir=APP_DIR):
+    """Return the category for a root-to-leaf list of (filename, name, line).
+
+    The walk stops at the first frame from `app_dir`: time spent in our own
+    code (numpy work in inference.py, hashing in uploads.py, ...) is "app",
+    not charged to the Flask frames that dispatched the request.
+    """
+    app_dir = os.path.join(app_dir, "")
+    for filename, name, _ in reversed(stack):
+        for category, rule in CATEGORY_RULES:
+            if rule(filename, name):
+                return category
+        if os.path.abspath(filename).startswith(app_dir):
+            return "app"
+    return "other"
+
+
+class ProfileSession:
+    def __init__(self, requests=None, seconds=None, interval_ms=5.0, trace_malloc=True, malloc_top=25):
+        if not requests and not seconds:
+            raise ValueError("either requests or seconds is required")
+        self.id = uuid.uuid4().hex
+        self.requests = int(requests) if requests else None
+        self.seconds = float(seconds) if seconds else None
+        if self.requests is not None and not 0 < self.requests <= MAX_REQUESTS:
+            raise ValueError(f"requests must be between 1 and {MAX_REQUESTS}")
+        if self.seconds is not None and not 0 < self.seconds <= MAX_WINDOW_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {MAX_WINDOW_SECONDS}")
+        self.interval = min(max(float(interval_ms), 1.0), MAX_INTERVAL_MS) / 1000.0
+        self.trace_malloc = bool(trace_malloc)
+        self.malloc_top = int(malloc_top)
+
+        self.status = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self.requests_seen = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._active_threads = {}
+        self._frames = []
+        self._frame_index = {}
+        self._samples = []
+        self._weights = []
+        self._categories = Counter()
+        self._gc_start = None
+        self._gc_ms = 0.0
+        self._gc_count = Counter()
+        self._malloc_started = False
+        self._malloc_baseline = None
+        self._malloc_stats = None
+        # on_finish(session) is called once the session is done; should_stop()
+        # lets another process ask the sampler to stop early
+        self.on_finish = None
+        self.should_stop = None
+
+    # lifecycle
+
+    def start(self):
+        self.status = "running"
+        self.started_at = time.time()
+        gc.callbacks.append(self._on_gc)
+        if self.trace_malloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(1)
+                self._malloc_started = True
+            self._malloc_baseline = tracemalloc.take_snapshot()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.status != "running":
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self.status != "running":
+                return
+            self.status = "done"
+            self.finished_at = time.time()
+        try:
+            gc.callbacks.remove(self._on_gc)
+        except ValueError:
+            pass
+        if self.trace_malloc and tracemalloc.is_tracing():
+            try:
+                snap = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                ))
+                diff = snap.compare_to(self._malloc_baseline, "lineno") if self._malloc_baseline else []
+                self._malloc_stats = [
+                    {
+                        "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                        "size_kb": round(s.size / 1024.0, 1),
+                        "size_diff_kb": round(s.size_diff / 1024.0, 1),
+                        "count": s.count,
+                        "count_diff": s.count_diff,
+                    }
+                    for s in diff[:self.malloc_top]
+                ]
+            finally:
+                self._malloc_baseline = None
+                if self._malloc_started:
+                    tracemalloc.stop()
+        if self.on_finish is not None:
+            try:
+                self.on_finish(self)
+            except Exception as e:
+                print(f"[profile] saving session {self.id} failed: {e}")
+
+    # request hooks
+
+    def request_started(self):
+        if self.status != "running":
+            return
+        with self._lock:
+            self._active_threads[threading.get_ident()] = time.monotonic()
+
+    def request_finished(self):
+        if self.status != "running":
+            return
+        with self._lock:
+            if self._active_threads.pop(threading.get_ident(), None) is None:
+                return
+            self.requests_seen += 1
+            done = self.requests is not None and self.requests_seen >= self.requests
+        if done:
+            self._stop.set()
+
+    # sampling
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            self._gc_ms += (time.perf_counter() - self._gc_start) * 1000.0
+            self._gc_count[info.get("generation")] += 1
+            self._gc_start = None
+
+    def _frame_id(self, key):
+        idx = self._frame_index.get(key)
+        if idx is None:
+            idx = len(self._frames)
+            self._frame_index[key] = idx
+            self._frames.append(key)
+        return idx
+
+    def _run(self):
+        deadline = time.monotonic() + self.seconds if self.seconds else None
+        last = last_stop_check = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            weight = (now - last) * 1000.0
+            last = now
+            if self.should_stop is not None and now - last_stop_check >= STOP_CHECK_SECONDS:
+                last_stop_check = now
+                if self.should_stop():
+                    break
+            with self._lock:
+                targets = list(self._active_threads)
+            if targets:
+                frames = sys._current_frames()
+                for tid in targets:
+                    frame = frames.get(tid)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                        frame = frame.f_back
+                    stack.reverse()
+                    self._samples.append([self._frame_id(k) for k in stack])
+                    self._weights.append(weight)
+                    self._categories[categorize(stack)] += weight
+            if deadline is not None and now >= deadline:
+                break
+        self._finish()
+
+    # reports
+
+    def summary(self):
+        total = sum(self._weights)
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        out = {
+            "id": self.id,
+            "status": self.status,
+            "mode": "requests" if self.requests else "window",
+            "requests": self.requests,
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000.0,
+            "requests_seen": self.requests_seen,
+            "elapsed_s": round(elapsed, 3),
+            "samples": len(self._samples),
+            "sampled_ms": round(total, 1),
+            "categories_ms": {k: round(v, 1) for k, v in self._categories.most_common()},
+            "categories_pct": {k: round(100.0 * v / total, 1) for k, v in self._categories.most_common()} if total else {},
+            "gc": {"ms": round(self._gc_ms, 2), "collections": {str(k): v for k, v in self._gc_count.items()}},
+        }
+        if self._malloc_stats is not None:
+            out["allocations"] = self._malloc_stats
+        return out
+
+    def speedscope(self):
+        """Export as a speedscope "sampled" profile (https://www.speedscope.app)."""
+        total = sum(self._weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"soundaware profile {self.id}",
+            "exporter": "soundaware-profiling",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [{"name": name, "file": filename, "line": line} for filename, name, line in self._frames],
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.requests_seen} request(s)",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": self._samples,
+                "weights": self._weights,
+            }],
+        }
+
+    def collapsed(self):
+        """Folded stacks ("a;b;c <ms>") for flamegraph.pl / inferno."""
+        folded = Counter()
+        for sample, weight in zip(self._samples, self._weights):
+            names = []
+            for idx in sample:
+                filename, name, line = self._frames[idx]
+                names.append(f"{name} ({os.path.basename(filename)}:{line})")
+            folded[";".join(names)] += weight
+        return "\n".join(f"{stack} {int(round(ms))}" for stack, ms in folded.most_common()) + "\n"
+
+
+class ProfileStore:
+    """Directory of session reports, shared by every server process.
+
+    Per session id: `<id>.json` (summary), `<id>.speedscope.json`,
+    `<id>.folded` and, while a stop was requested, `<id>.stop`.
+    """
+
+    FILES = {"summary": ".json", "speedscope": ".speedscope.json", "collapsed": ".folded", "stop": ".stop"}
+
+    def __init__(self, directory=None, keep=20):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "soundaware_profiles")
+        self.keep = int(keep)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, session_id, fmt="summary"):
+        if not SESSION_ID_RE.match(session_id or ""):
+            raise ValueError("invalid profile session id")
+        return os.path.join(self.directory, session_id + self.FILES[fmt])
+
+    def _write(self, path, text):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+        os.replace(tmp, path)
+
+    def save_summary(self, session):
+        self._write(self.path(session.id), json.dumps(session.summary()))
+
+    def save(self, session):
+        """Write all reports of a finished session, then drop the oldest beyond `keep`."""
+        self._write(self.path(session.id, "speedscope"), json.dumps(session.speedscope()))
+        self._write(self.path(session.id, "collapsed"), session.collapsed())
+        # the summary goes last: once it says "done" the other files exist
+        self.save_summary(session)
+        self.clear_stop(session.id)
+        self.prune()
+
+    def load(self, session_id, fmt="summary"):
+        """Return the stored report as text, or None if there is none."""
+        try:
+            with open(self.path(session_id, fmt)) as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def latest_id(self):
+        summaries = self._summaries()
+        return summaries[-1][1] if summaries else None
+
+    def request_stop(self, session_id):
+        self._write(self.path(session_id, "stop"), "")
+
+    def stop_requested(self, session_id):
+        return os.path.exists(self.path(session_id, "stop"))
+
+    def clear_stop(self, session_id):
+        try:
+            os.remove(self.path(session_id, "stop"))
+        except FileNotFoundError:
+            pass
+
+    def _summaries(self):
+        out = []
+        for name in os.listdir(self.directory):
+            sid = name[:-len(".json")]
+            # "<id>.speedscope.json" also ends in .json but its stem is not an id
+            if name.endswith(".json") and SESSION_ID_RE.match(sid):
+                try:
+                    out.append((os.path.getmtime(os.path.join(self.directory, name)), sid))
+                except FileNotFoundError:
+                    continue
+        return sorted(out)
+
+    def prune(self):
+        summaries = self._summaries()
+        for _, sid in summaries[:max(0, len(summaries) - self.keep)]:
+            for fmt in self.FILES:
+                try:
+                    os.remove(self.path(sid, fmt))
+                except FileNotFoundError:
+                    pass
+
+
+class Profiler:
+    """Holds at most one active session and the last finished one.
+
+    With a `store`, sessions are written there when they start and when they
+    finish, and a stop requested through the store is honoured by the sampler.
+    """
+
+    def __init__(self, store=None):
+        self.session = None
+        self.store = store
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        s = self.session
+        return s is not None and s.status == "running"
+
+    def start(self, **kwargs):
+        with self._lock:
+            if self.active:
+                raise RuntimeError("a profiling session is already running")
+            session = ProfileSession(**kwargs)
+            if self.store is not None:
+                session.on_finish = self.store.save
+                session.should_stop = lambda: self.store.stop_requested(session.id)
+            session.start()
+            if self.store is not None:
+                self.store.save_summary(session)
+            self.session = session
+            return session
+
+    def stop(self):
+        s = self.session
+        if s is not None:
+            s.stop()
+        return s
+
+    def request_started(self):
+        s = self.session
+        if s is not None and s.status == "running":
+            s.request_started()
+
+    def request_finished(self):
+        s = self.session
+        if s is not None and s.status == "running":
+            s.request_finished()
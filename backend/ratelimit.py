@@ -0,0 +1,148 @@
+"""Token-bucket admission control shared across gunicorn workers.
+
+Buckets live in a small memory-mapped file (under /dev/shm when available) so
+every worker process on the host sees the same balances. Each slot is
+(key hash, tokens, last refill time); lookups use open addressing, and when a
+probe window is full the least recently touched slot is recycled.
+
+On platforms without `fcntl` (Windows dev runs with a single process) the
+file lock is skipped and a thread lock alone protects the table.
+"""
+import os
+import mmap
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+SLOT = struct.Struct("<Qdd")
+DEFAULT_SLOTS = 8192
+PROBE = 16
+
+
+def default_path():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "soundaware_ratelimit")
+
+
+def bucket_hash(scope, ident):
+    digest = hashlib.blake2b(f"{scope}:{ident}".encode(), digest_size=8).digest()
+    # 0 marks an empty slot
+    return int.from_bytes(digest, "little") or 1
+
+
+def parse_rate(spec, default):
+    """Parse "rate/burst" (tokens per second / bucket size)."""
+    if not spec:
+        return default
+    rate, _, burst = spec.partition("/")
+    rate = float(rate)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+
+class SharedTokenBuckets:
+    def __init__(self, path=None, slots=DEFAULT_SLOTS):
+        self.path = path or default_path()
+        self.slots = slots
+        size = SLOT.size * slots
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                # first process on the host (or a resized table) initialises the file
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size != size:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, size)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._tlock = threading.Lock()
+
+    def _lock(self):
+        self._tlock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._tlock.release()
+
+    def _bucket(self, h, rate, burst, now):
+        """Return (slot index, refilled tokens) for hash `h`, claiming a slot if needed."""
+        start = h % self.slots
+        claim_idx, oldest_ts = None, None
+        for i in range(PROBE):
+            idx = (start + i) % self.slots
+            slot_h, tokens, ts = SLOT.unpack_from(self._mm, idx * SLOT.size)
+            if slot_h == h:
+                return idx, min(burst, tokens + max(0.0, now - ts) * rate)
+            if slot_h == 0:
+                claim_idx = idx
+                break
+            if oldest_ts is None or ts < oldest_ts:
+                claim_idx, oldest_ts = idx, ts
+        # new (or evicted) bucket starts full; write it now so later lookups see it
+        SLOT.pack_into(self._mm, claim_idx * SLOT.size, h, burst, now)
+        return claim_idx, burst
+
+    def take(self, buckets, cost):
+        """Atomically take `cost` tokens from every bucket or from none.
+
+        `buckets` is a list of (hash, rate, burst). Returns (allowed, retry_after,
+        index of the bucket that refused or None).
+        """
+        now = time.time()
+        self._lock()
+        try:
+            state = []
+            for h, rate, burst in buckets:
+                idx, tokens = self._bucket(h, rate, burst, now)
+                state.append((idx, h, tokens))
+            for n, ((idx, h, tokens), (_, rate, burst)) in enumerate(zip(state, buckets)):
+                # a request costing more than the bucket holds is admitted from a full bucket
+                need = min(cost, burst)
+                if tokens < need:
+                    retry_after = (need - tokens) / rate if rate > 0 else None
+                    # persist the refill so the balance keeps accruing correctly
+                    for idx2, h2, tokens2 in state:
+                        SLOT.pack_into(self._mm, idx2 * SLOT.size, h2, tokens2, now)
+                    return False, retry_after, n
+            for idx, h, tokens in state:
+                SLOT.pack_into(self._mm, idx * SLOT.size, h, tokens - cost, now)
+            return True, 0.0, None
+        finally:
+            self._unlock()
+
+    def charge(self, buckets, cost):
+        """Deduct `cost` without refusing; balances may go negative (debt)."""
+        now = time.time()
+        self._lock()
+        try:
+            for h, rate, burst in buckets:
+                idx, tokens = self._bucket(h, rate, burst, now)
+                SLOT.pack_into(self._mm, idx * SLOT.size, h, tokens - cost, now)
+        finally:
+            self._unlock()
+
+    def peek(self, h, rate, burst):
+        now = time.time()
+        self._lock()
+        try:
+            return self._bucket(h, rate, burst, now)[1]
+        finally:
+            self._unlock()
@@ -0,0 +1,235 @@
+"""Priority-aware scheduler in front of `interpreter.invoke()`.
+
+Requests are tagged with a priority class (live, interactive, bulk). Each
+inference acquires one slot from a pool of interpreters; when a slot frees up
+it goes to the highest-priority waiter whose class is under its concurrency
+limit. Bulk work acquires a slot per inference, so a long batch yields to a
+live detection at every item boundary instead of holding the interpreter.
+"""
+import os
+import mmap
+import time
+import struct
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+PRIORITIES = ("live", "interactive", "bulk")
+
+PRIORITY_ALIASES = {
+    "live": "live",
+    "streaming": "live",
+    "stream": "live",
+    "realtime": "live",
+    "interactive": "interactive",
+    "default": "interactive",
+    "bulk": "bulk",
+    "batch": "bulk",
+    "background": "bulk",
+}
+
+WAIT_SAMPLES = 1024
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request waited longer than the queue timeout for a slot."""
+
+
+def parse_priority(value, default="interactive"):
+    if value is None or str(value).strip() == "":
+        return default
+    key = str(value).strip().lower()
+    if key not in PRIORITY_ALIASES:
+        raise ValueError(f"unknown priority {value!r}; expected one of {', '.join(PRIORITIES)}")
+    return PRIORITY_ALIASES[key]
+
+
+def priority_rank(priority):
+    return PRIORITIES.index(priority)
+
+
+def cap_priority(priority, max_priority):
+    """Return `priority`, lowered to `max_priority` if it asks for more."""
+    return PRIORITIES[max(priority_rank(priority), priority_rank(max_priority))]
+
+
+def parse_priority_caps(spec):
+    """Parse "mobile=live,batch=bulk" into {key name: highest allowed priority}."""
+    caps = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, _, prio = part.partition("=")
+        caps[name.strip()] = parse_priority(prio)
+    return caps
+
+
+class LiveDemandFlag:
+    """Cross-process "live requests are active" flag.
+
+    The web tier marks it while live requests wait for or hold a slot; the job
+    workers in other processes read it and hold back bulk work, so batch
+    inference yields CPU to live detections even though it runs elsewhere.
+    Stored as one timestamp in a small memory-mapped file: `path`, else
+    LIVE_DEMAND_SHM, else /dev/shm/soundaware_live_demand, so the web tier
+    and the workers agree on it without passing it around.
+    """
+
+    SLOT = struct.Struct("<d")
+
+    def __init__(self, path=None):
+        path = path or os.environ.get("LIVE_DEMAND_SHM")
+        if not path:
+            base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            path = os.path.join(base, "soundaware_live_demand")
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.SLOT.size:
+                os.ftruncate(fd, self.SLOT.size)
+            self._mm = mmap.mmap(fd, self.SLOT.size)
+        finally:
+            os.close(fd)
+
+    def mark(self):
+        self.SLOT.pack_into(self._mm, 0, time.time())
+
+    def last_seen(self):
+        return self.SLOT.unpack_from(self._mm, 0)[0]
+
+    def active(self, window):
+        return time.time() - self.last_seen() < window
+
+
+def parse_limits(spec, slots):
+    """Parse "live=2,interactive=2,bulk=1" into per-class concurrency limits.
+
+    Defaults: live and interactive may use every slot, bulk at most half
+    (minimum one) so there is always headroom for higher classes.
+    """
+    limits = {"live": slots, "interactive": slots, "bulk": max(1, slots // 2)}
+    if spec:
+        for part in spec.split(","):
+            if not part.strip():
+                continue
+            name, _, val = part.partition("=")
+            limits[parse_priority(name)] = max(1, min(slots, int(val)))
+    return limits
+
+
+def _percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    idx = min(len(sorted_vals) - 1, int(round(pct / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+class InferenceScheduler:
+    def __init__(self, models, limits=None, queue_timeout=None, live_flag=None):
+        if not models:
+            raise ValueError("scheduler needs at least one model slot")
+        self._models = list(models)
+        self._free = deque(range(len(self._models)))
+        self.limits = limits or parse_limits(None, len(self._models))
+        self.queue_timeout = queue_timeout
+        self.live_flag = live_flag
+        self._cond = threading.Condition()
+        self._waiting = {p: deque() for p in PRIORITIES}
+        self._running = {p: 0 for p in PRIORITIES}
+        self._served = {p: 0 for p in PRIORITIES}
+        self._rejected = {p: 0 for p in PRIORITIES}
+        self._waits = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self._max_wait = {p: 0.0 for p in PRIORITIES}
+
+    @property
+    def slots(self):
+        return len(self._models)
+
+    def _eligible(self, priority):
+        return self._running[priority] < self.limits[priority]
+
+    def _can_run(self, priority, ticket):
+        if not self._free:
+            return False
+        if self._waiting[priority][0] is not ticket or not self._eligible(priority):
+            return False
+        # a waiting higher-priority class that is allowed to run goes first
+        for p in PRIORITIES[:priority_rank(priority)]:
+            if self._waiting[p] and self._eligible(p):
+                return False
+        return True
+
+    @contextmanager
+    def slot(self, priority):
+        """Block until a slot is granted to `priority`; yields that slot's model."""
+        ticket = object()
+        start = time.monotonic()
+        if priority == "live" and self.live_flag is not None:
+            self.live_flag.mark()
+        deadline = start + self.queue_timeout if self.queue_timeout else None
+        with self._cond:
+            self._waiting[priority].append(ticket)
+            try:
+                while not self._can_run(priority, ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._rejected[priority] += 1
+                        raise SchedulerBusy(f"no inference slot for {priority} request within {self.queue_timeout}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiting[priority].remove(ticket)
+                # our departure may unblock a lower-priority waiter
+                self._cond.notify_all()
+                raise
+            self._waiting[priority].popleft()
+            idx = self._free.popleft()
+            self._running[priority] += 1
+            waited = time.monotonic() - start
+            self._waits[priority].append(waited)
+            self._max_wait[priority] = max(self._max_wait[priority], waited)
+            # the next waiter in this class may be able to take another free slot
+            self._cond.notify_all()
+        try:
+            yield self._models[idx]
+        finally:
+            if priority == "live" and self.live_flag is not None:
+                self.live_flag.mark()
+            with self._cond:
+                self._free.append(idx)
+                self._running[priority] -= 1
+                self._served[priority] += 1
+                self._cond.notify_all()
+
+    def run(self, priority, fn, *args, **kwargs):
+        """Call fn(model, *args, **kwargs) while holding a slot for `priority`."""
+        with self.slot(priority) as model:
+            return fn(model, *args, **kwargs)
+
+    def stats(self):
+        with self._cond:
+            classes = {}
+            for p in PRIORITIES:
+                waits = sorted(self._waits[p])
+                classes[p] = {
+                    "limit": self.limits[p],
+                    "running": self._running[p],
+                    "waiting": len(self._waiting[p]),
+                    "served": self._served[p],
+                    "rejected": self._rejected[p],
+                    "queue_wait_ms": {
+                        "samples": len(waits),
+                        "mean": (1000.0 * sum(waits) / len(waits)) if waits else None,
+                        "p50": None if not waits else 1000.0 * _percentile(waits, 50),
+                        "p95": None if not waits else 1000.0 * _percentile(waits, 95),
+                        "p99": None if not waits else 1000.0 * _percentile(waits, 99),
+                        "max": 1000.0 * self._max_wait[p],
+                    },
+                }
+            return {
+                "slots": self.slots,
+                "free_slots": len(self._free),
+                "queue_timeout": self.queue_timeout,
+                "classes": classes,
+            }
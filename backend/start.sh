@@ -0,0 +1,15 @@
+#!/bin/sh
+# Container entrypoint: job workers for /jobs in the background, gunicorn in the foreground.
+set -e
+
+# restart the worker pool if it ever exits so queued jobs keep draining
+(
+  while true; do
+    python worker.py --workers "${JOB_WORKERS:-1}" || true
+    echo "[start] worker.py exited; restarting in 2s"
+    sleep 2
+  done
+) &
+
+# app:create_app() --> means create_app() is inside app.py
+exec gunicorn "app:create_app()" --bind 0.0.0.0:5000 --workers 2 --threads 4 --timeout 200
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from cascade import Cascade, TemplateStage, fit_templates, label_factors, split_label, template_features
+
+CLASS_NAMES = [
+    "dog_barking_speech", "dog_barking_no_speech",
+    "glass_breaking_speech", "glass_breaking_no_speech",
+    "gun_shot_speech", "gun_shot_no_speech",
+    "crying_speech", "crying_no_speech",
+]
+ESCALATE = ("glass_breaking", "gun_shot", "crying")
+
+
+class FixedStage:
+    """Stage that always predicts one label with the given confidence."""
+
+    def __init__(self, name, label, confidence, threshold=0.9):
+        self.name = name
+        self.threshold = threshold
+        self.probs = np.full(len(CLASS_NAMES), (1.0 - confidence) / (len(CLASS_NAMES) - 1))
+        self.probs[CLASS_NAMES.index(label)] = confidence
+        self.calls = 0
+
+    def predict(self, input_image):
+        self.calls += 1
+        return self.probs, float(np.max(self.probs))
+
+
+def test_split_label():
+    assert split_label("dog_barking_no_speech") == ("dog_barking", "no_speech")
+    assert split_label("gun_shot_speech") == ("gun_shot", "speech")
+    assert split_label("silence") == ("silence", None)
+
+
+def test_label_factors():
+    events, speech, pairs = label_factors(CLASS_NAMES)
+    assert events == ["dog_barking", "glass_breaking", "gun_shot", "crying"]
+    assert speech == ["speech", "no_speech"]
+    assert pairs[CLASS_NAMES.index("crying_no_speech")] == (3, 1)
+
+
+def test_confident_stage_answers_early():
+    stage = FixedStage("template", "dog_barking_no_speech", 0.95)
+    cascade = Cascade([stage], CLASS_NAMES, ESCALATE)
+    probs, info = cascade.try_answer(None)
+    assert probs is stage.probs and info["answered_by"] == "template"
+    assert cascade.stats()["answered"] == {"template": 1}
+
+
+@pytest.mark.parametrize("label", ["glass_breaking_no_speech", "gun_shot_speech", "crying_no_speech"])
+def test_confident_safety_critical_prediction_is_escalated(label):
+    first = FixedStage("template", label, 0.99)
+    second = FixedStage("tflite", "dog_barking_speech", 0.99)
+    cascade = Cascade([first, second], CLASS_NAMES, ESCALATE)
+    probs, info = cascade.try_answer(None)
+    assert probs is None and info["answered_by"] == "full_model"
+    # the full model confirms it; later cheap stages don't get to overrule it
+    assert second.calls == 0
+    assert cascade.stats()["escalated_safety_critical"] == 1
+
+
+def test_unsure_stages_fall_through_to_the_next_then_the_full_model():
+    first = FixedStage("template", "dog_barking_speech", 0.5)
+    second = FixedStage("tflite", "dog_barking_no_speech", 0.95)
+    probs, info = Cascade([first, second], CLASS_NAMES, ESCALATE).try_answer(None)
+    assert info["answered_by"] == "tflite" and [s["stage"] for s in info["stages"]] == ["template", "tflite"]
+
+    second.threshold = 0.99
+    cascade = Cascade([first, second], CLASS_NAMES, ESCALATE)
+    assert cascade.try_answer(None)[0] is None
+    assert cascade.stats()["escalated"] == 1
+
+
+def test_template_stage_round_trip():
+    rng = np.random.default_rng(0)
+    n_mels, frames = 8, 20
+    images, labels = [], []
+    for label in range(len(CLASS_NAMES)):
+        for _ in range(5):
+            mel = rng.normal(size=(n_mels, frames)) + label
+            images.append(mel.reshape(1, n_mels, frames, 1))
+            labels.append(label)
+    features = np.stack([template_features(img) for img in images])
+    stage = TemplateStage(fit_templates(features, labels, CLASS_NAMES), CLASS_NAMES)
+    probs, confidence = stage.predict(images[0])
+    assert probs.shape == (len(CLASS_NAMES),)
+    assert probs.sum() == pytest.approx(1.0)
+    assert confidence == pytest.approx(probs.max())
+    with pytest.raises(ValueError):
+        TemplateStage(fit_templates(features, labels, CLASS_NAMES), CLASS_NAMES[::-1])
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setenv("JOBS_DIR", str(tmp_path))
+    monkeypatch.delenv("JOBS_DB", raising=False)
+    c = jobs.connect()
+    yield c
+    c.close()
+
+
+def spooled(conn, name, priority="bulk", owner="mobile"):
+    path = jobs.spool_path()
+    with open(path, "wb") as fh:
+        fh.write(b"RIFF")
+    return jobs.enqueue(conn, path, filename=name, priority=priority, owner=owner), path
+
+
+def make_stale(conn, job_id):
+    conn.execute("UPDATE jobs SET started_at = 0 WHERE id = ?", (job_id,))
+
+
+def test_claim_order_is_priority_then_age(conn):
+    spooled(conn, "bulk-1")
+    spooled(conn, "interactive-1", "interactive")
+    spooled(conn, "bulk-2")
+    spooled(conn, "live-1", "live")
+    claimed = [jobs.claim(conn, "w")["filename"] for _ in range(4)]
+    assert claimed == ["live-1", "interactive-1", "bulk-1", "bulk-2"]
+    assert jobs.claim(conn, "w") is None
+
+
+def test_claim_max_priority_leaves_lower_classes_queued(conn):
+    spooled(conn, "bulk-1")
+    spooled(conn, "interactive-1", "interactive")
+    assert jobs.claim(conn, "w", "live") is None
+    assert jobs.claim(conn, "w", "interactive")["filename"] == "interactive-1"
+    assert jobs.claim(conn, "w", "interactive") is None
+    assert jobs.queue_depth(conn) == 1
+
+
+def test_jobs_are_private_to_their_key(conn):
+    job_id, _ = spooled(conn, "a", owner="mobile")
+    assert jobs.get(conn, job_id, "mobile")["status"] == jobs.STATUS_QUEUED
+    assert jobs.get(conn, job_id, "batch") is None
+
+
+def test_requeue_only_jobs_of_silent_workers(conn):
+    job_id, _ = spooled(conn, "a")
+    jobs.claim(conn, "w1")
+    make_stale(conn, job_id)
+
+    # a slow job on a worker that still checks in is left alone
+    jobs.heartbeat(conn, "w1")
+    assert jobs.requeue_stale(conn, 60) == 0
+
+    conn.execute("UPDATE workers SET last_seen = 0")
+    assert jobs.requeue_stale(conn, 60) == 1
+    assert jobs.get(conn, job_id, "mobile")["status"] == jobs.STATUS_QUEUED
+
+
+def test_outcome_of_a_reassigned_job_is_discarded(conn):
+    job_id, _ = spooled(conn, "a")
+    jobs.claim(conn, "w1")
+    make_stale(conn, job_id)
+    jobs.requeue_stale(conn, 60)
+    jobs.claim(conn, "w2")
+
+    assert not jobs.fail(conn, job_id, "w1", "too late")
+    assert jobs.complete(conn, job_id, "w2", {"pred_label": "siren_no_speech"})
+    job = jobs.get(conn, job_id, "mobile")
+    assert job["status"] == jobs.STATUS_DONE and job["attempts"] == 2
+    assert not jobs.complete(conn, job_id, "w2", {"pred_label": "again"})
+
+
+def test_stale_job_fails_after_max_attempts_and_drops_its_file(conn):
+    job_id, path = spooled(conn, "a")
+    for attempt in range(3):
+        assert jobs.claim(conn, f"w{attempt}")["id"] == job_id
+        make_stale(conn, job_id)
+        jobs.requeue_stale(conn, 60, max_attempts=3)
+    job = jobs.get(conn, job_id, "mobile")
+    assert job["status"] == jobs.STATUS_FAILED and job["error"] == "worker timed out"
+    assert not os.path.exists(path)
@@ -0,0 +1,102 @@
+import os
+import json
+
+import pytest
+
+from profiling import MAX_REQUESTS, Profiler, ProfileSession, ProfileStore, categorize
+
+APP = "/srv/backend"
+FLASK = "/usr/lib/python3/site-packages/flask/app.py"
+WERKZEUG = "/usr/lib/python3/site-packages/werkzeug/serving.py"
+
+
+def stack(*frames):
+    return [(filename, name, 1) for filename, name in frames]
+
+
+def request_stack(*leaf):
+    """Root-to-leaf frames of a request thread: werkzeug/flask dispatch, then our view."""
+    return stack((WERKZEUG, "run_wsgi"), (FLASK, "full_dispatch_request"), (os.path.join(APP, "app.py"), "predict"), *leaf)
+
+
+def test_app_code_is_not_charged_to_flask():
+    numpy_leaf = ("/usr/lib/python3/site-packages/numpy/core/fromnumeric.py", "argsort")
+    assert categorize(request_stack((os.path.join(APP, "inference.py"), "build_result"), numpy_leaf), APP) == "app"
+    assert categorize(request_stack((os.path.join(APP, "uploads.py"), "file_sha256")), APP) == "app"
+
+
+def test_library_frames_on_the_leaf_side_win():
+    assert categorize(request_stack(("/usr/lib/python3/site-packages/librosa/core/spectrum.py", "stft")), APP) == "librosa"
+    assert categorize(request_stack(("/usr/lib/python3.11/subprocess.py", "communicate")), APP) == "ffmpeg"
+    assert categorize(request_stack(("/usr/lib/python3/site-packages/tflite_runtime/interpreter.py", "invoke")), APP) == "interpreter.invoke"
+    assert categorize(request_stack((os.path.join(APP, "scheduler.py"), "slot")), APP) == "scheduler_wait"
+    assert categorize(request_stack((FLASK, "jsonify"), ("/usr/lib/python3.11/json/encoder.py", "encode")), APP) == "flask_json"
+
+
+def test_dispatch_outside_app_code():
+    assert categorize(stack((WERKZEUG, "run_wsgi"), (FLASK, "preprocess_request")), APP) == "flask_json"
+    assert categorize(stack(("/usr/lib/python3.11/threading.py", "run")), APP) == "other"
+
+
+def test_session_counts_requests_and_stops_itself():
+    session = ProfileSession(requests=2, interval_ms=1, trace_malloc=False)
+    session.start()
+    for _ in range(2):
+        session.request_started()
+        session.request_finished()
+    # a teardown without a matching start (request began before the session) is ignored
+    session.request_finished()
+    session._thread.join(5)
+    assert session.status == "done"
+    assert session.summary()["requests_seen"] == 2
+
+
+def test_session_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        ProfileSession()
+    with pytest.raises(ValueError):
+        ProfileSession(requests=MAX_REQUESTS + 1)
+
+
+def test_profiler_allows_one_running_session(tmp_path):
+    profiler = Profiler(ProfileStore(str(tmp_path)))
+    session = profiler.start(seconds=30, trace_malloc=False)
+    with pytest.raises(RuntimeError):
+        profiler.start(seconds=30, trace_malloc=False)
+    assert json.loads(profiler.store.load(session.id))["status"] == "running"
+    profiler.stop()
+    assert json.loads(profiler.store.load(session.id))["status"] == "done"
+    assert profiler.store.load(session.id, "speedscope") is not None
+
+
+def test_stop_requested_through_the_store(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    session = Profiler(store).start(seconds=30, interval_ms=5, trace_malloc=False)
+    store.request_stop(session.id)
+    session._thread.join(5)
+    assert session.status == "done"
+    assert not store.stop_requested(session.id)
+
+
+def test_store_rejects_ids_that_are_not_session_ids(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    for bad in ("../../etc/passwd", "", "ABC", "0" * 31):
+        with pytest.raises(ValueError):
+            store.path(bad)
+    assert store.load("0" * 32) is None
+
+
+def test_store_keeps_only_the_newest_sessions(tmp_path):
+    store = ProfileStore(str(tmp_path), keep=2)
+    ids = []
+    for i in range(4):
+        session = ProfileSession(requests=1, trace_malloc=False)
+        session.started_at = session.finished_at = 1000.0 + i
+        store.save(session)
+        # mtime decides the order; don't depend on the filesystem's timestamp resolution
+        os.utime(store.path(session.id), (1000 + i, 1000 + i))
+        ids.append(session.id)
+    store.prune()
+    assert store.latest_id() == ids[-1]
+    assert [store.load(i) is not None for i in ids] == [False, False, True, True]
+    assert not [n for n in os.listdir(tmp_path) if n.startswith((ids[0], ids[1]))]
@@ -0,0 +1,89 @@
+import pytest
+
+import ratelimit
+from ratelimit import SharedTokenBuckets, bucket_hash, parse_rate
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(ratelimit.time, "time", c)
+    return c
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    return SharedTokenBuckets(str(tmp_path / "buckets"), slots=64)
+
+
+def test_parse_rate():
+    assert parse_rate(None, (1.0, 2.0)) == (1.0, 2.0)
+    assert parse_rate("10/100", None) == (10.0, 100.0)
+    assert parse_rate("0.5", None) == (0.5, 1.0)
+
+
+def test_new_bucket_starts_full_then_refuses(buckets, clock):
+    b = [(bucket_hash("key", "mobile"), 2.0, 5.0)]
+    for _ in range(5):
+        assert buckets.take(b, 1)[0]
+    allowed, retry_after, refused = buckets.take(b, 1)
+    assert not allowed
+    assert refused == 0
+    assert retry_after == pytest.approx(0.5)
+
+
+def test_refill_over_time_is_capped_at_burst(buckets, clock):
+    b = [(bucket_hash("key", "mobile"), 2.0, 5.0)]
+    assert buckets.take(b, 5)[0]
+    assert not buckets.take(b, 1)[0]
+
+    clock.now += 0.5
+    assert buckets.take(b, 1)[0]
+    assert not buckets.take(b, 1)[0]
+
+    clock.now += 3600
+    assert buckets.peek(*b[0]) == pytest.approx(5.0)
+
+
+def test_refusal_is_atomic_across_buckets(buckets, clock):
+    key = (bucket_hash("key", "mobile"), 10.0, 100.0)
+    ip = (bucket_hash("ip", "10.0.0.1"), 1.0, 2.0)
+    assert buckets.take([key, ip], 2)[0]
+
+    allowed, retry_after, refused = buckets.take([key, ip], 1)
+    assert not allowed
+    assert refused == 1
+    assert retry_after == pytest.approx(1.0)
+    # the key bucket was not charged for the refused request
+    assert buckets.peek(*key) == pytest.approx(98.0)
+
+
+def test_cost_above_burst_is_admitted_from_a_full_bucket(buckets, clock):
+    b = [(bucket_hash("ip", "10.0.0.2"), 1.0, 3.0)]
+    assert buckets.take(b, 10)[0]
+    assert buckets.peek(*b[0]) == pytest.approx(-7.0)
+    assert not buckets.take(b, 1)[0]
+
+
+def test_charge_allows_debt(buckets, clock):
+    b = [(bucket_hash("key", "batch"), 1.0, 4.0)]
+    buckets.charge(b, 6)
+    assert buckets.peek(*b[0]) == pytest.approx(-2.0)
+    clock.now += 3
+    assert buckets.peek(*b[0]) == pytest.approx(1.0)
+
+
+def test_balances_are_shared_through_the_file(tmp_path, clock):
+    path = str(tmp_path / "shared")
+    b = [(bucket_hash("key", "mobile"), 1.0, 2.0)]
+    first, second = SharedTokenBuckets(path, slots=64), SharedTokenBuckets(path, slots=64)
+    assert first.take(b, 2)[0]
+    assert not second.take(b, 1)[0]
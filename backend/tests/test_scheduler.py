@@ -0,0 +1,117 @@
+import time
+import threading
+
+import pytest
+
+from scheduler import (
+    InferenceScheduler, LiveDemandFlag, SchedulerBusy,
+    cap_priority, parse_limits, parse_priority, parse_priority_caps,
+)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def waiting(sched, priority):
+    return sched.stats()["classes"][priority]["waiting"]
+
+
+def start_waiter(sched, priority, granted, release=None):
+    """Start a thread that takes a slot; returns once it is queued or granted."""
+    before = waiting(sched, priority) + granted.count(priority)
+
+    def run():
+        with sched.slot(priority):
+            granted.append(priority)
+            if release is not None:
+                release.wait(5)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    wait_until(lambda: waiting(sched, priority) + granted.count(priority) > before)
+    return t
+
+
+def test_parse_priority_and_caps():
+    assert parse_priority(None) == "interactive"
+    assert parse_priority("Streaming") == "live"
+    assert parse_priority("batch") == "bulk"
+    with pytest.raises(ValueError):
+        parse_priority("urgent")
+    assert parse_priority_caps("mobile=live, batch=bulk") == {"mobile": "live", "batch": "bulk"}
+    assert cap_priority("live", "interactive") == "interactive"
+    assert cap_priority("bulk", "live") == "bulk"
+
+
+def test_parse_limits_defaults_keep_headroom_for_bulk():
+    assert parse_limits(None, 4) == {"live": 4, "interactive": 4, "bulk": 2}
+    assert parse_limits(None, 1)["bulk"] == 1
+    assert parse_limits("bulk=9,live=1", 4) == {"live": 1, "interactive": 4, "bulk": 4}
+
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    sched = InferenceScheduler(["model"])
+    granted = []
+    with sched.slot("bulk"):
+        threads = [start_waiter(sched, p, granted) for p in ("bulk", "interactive", "live", "live")]
+    for t in threads:
+        t.join(5)
+    assert granted == ["live", "live", "interactive", "bulk"]
+
+
+def test_class_at_its_limit_does_not_block_lower_classes():
+    sched = InferenceScheduler(["a", "b"], limits={"live": 2, "interactive": 2, "bulk": 1})
+    granted, release = [], threading.Event()
+    first = start_waiter(sched, "bulk", granted, release)
+    wait_until(lambda: granted == ["bulk"])
+
+    # bulk is at its limit: a second bulk request waits although a slot is free
+    second = start_waiter(sched, "bulk", granted, release)
+    time.sleep(0.05)
+    assert granted == ["bulk"] and waiting(sched, "bulk") == 1
+
+    # and it doesn't hold up interactive work behind it
+    interactive = start_waiter(sched, "interactive", granted, release)
+    wait_until(lambda: granted == ["bulk", "interactive"])
+
+    release.set()
+    for t in (first, second, interactive):
+        t.join(5)
+    assert granted == ["bulk", "interactive", "bulk"]
+    assert sched.stats()["classes"]["bulk"]["served"] == 2
+
+
+def test_queue_timeout_rejects_and_counts():
+    sched = InferenceScheduler(["model"], queue_timeout=0.05)
+    with sched.slot("interactive"):
+        with pytest.raises(SchedulerBusy):
+            with sched.slot("bulk"):
+                pass
+    stats = sched.stats()["classes"]["bulk"]
+    assert stats["rejected"] == 1 and stats["waiting"] == 0
+    # the slot is usable again afterwards
+    assert sched.run("bulk", lambda model: model) == "model"
+
+
+def test_live_requests_mark_the_demand_flag(tmp_path):
+    flag = LiveDemandFlag(str(tmp_path / "live"))
+    sched = InferenceScheduler(["model"], live_flag=flag)
+    sched.run("bulk", lambda model: None)
+    assert not flag.active(60)
+    sched.run("live", lambda model: None)
+    assert flag.active(60)
+    # other processes see the same flag
+    assert LiveDemandFlag(flag.path).active(60)
+
+
+def test_live_demand_flag_path_from_env(tmp_path, monkeypatch):
+    path = str(tmp_path / "from_env")
+    monkeypatch.setenv("LIVE_DEMAND_SHM", path)
+    web, worker = LiveDemandFlag(), LiveDemandFlag()
+    assert web.path == worker.path == path
+    web.mark()
+    assert worker.active(60)
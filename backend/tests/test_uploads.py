@@ -0,0 +1,108 @@
+import os
+import hashlib
+
+import pytest
+
+import uploads
+from uploads import UploadError
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOADS_DIR", str(tmp_path))
+    c = uploads.connect()
+    yield c
+    c.close()
+
+
+def raises_status(status, fn, *args, **kwargs):
+    with pytest.raises(UploadError) as info:
+        fn(*args, **kwargs)
+    assert info.value.status == status
+    return info.value
+
+
+DATA = os.urandom(1000)
+
+
+def test_append_requires_the_server_offset(conn):
+    row = uploads.create(conn, "mobile", filename="rec.webm", size=len(DATA))
+    uid = row["id"]
+    assert row["path"].endswith(".webm")
+    assert uploads.append(conn, uid, "mobile", 0, DATA[:400]) == 400
+
+    # a retried chunk whose response was lost: the server reports where it is
+    err = raises_status(409, uploads.append, conn, uid, "mobile", 0, DATA[:400])
+    assert err.extra["offset"] == 400
+    raises_status(409, uploads.append, conn, uid, "mobile", 600, DATA[600:])
+
+    assert uploads.append(conn, uid, "mobile", 400, DATA[400:]) == len(DATA)
+    with open(row["path"], "rb") as fh:
+        assert fh.read() == DATA
+
+
+def test_append_past_declared_size_is_rejected(conn):
+    uid = uploads.create(conn, "mobile", size=10)["id"]
+    err = raises_status(413, uploads.append, conn, uid, "mobile", 0, b"x" * 11)
+    assert err.extra["offset"] == 0
+    raises_status(413, uploads.create, conn, "mobile", size=100, max_bytes=50)
+
+
+def test_sessions_are_private_to_their_key(conn):
+    uid = uploads.create(conn, "mobile", size=4)["id"]
+    raises_status(404, uploads.get, conn, uid, "batch")
+    raises_status(404, uploads.append, conn, uid, "batch", 0, b"abcd")
+
+
+def test_finalize_state_machine(conn):
+    row = uploads.create(conn, "mobile", size=len(DATA), checksum=hashlib.sha256(DATA).hexdigest())
+    uid = row["id"]
+    raises_status(409, uploads.begin_finalize, conn, uid, "mobile")  # incomplete
+    uploads.append(conn, uid, "mobile", 0, DATA)
+
+    row = uploads.begin_finalize(conn, uid, "mobile")
+    assert row["status"] == uploads.STATUS_FINALIZING
+    # a concurrent finalize and late chunks are turned away while inference runs
+    raises_status(409, uploads.begin_finalize, conn, uid, "mobile")
+    raises_status(409, uploads.append, conn, uid, "mobile", len(DATA), b"x")
+
+    # a failed inference reopens the session for another finalize
+    uploads.abort_finalize(conn, uid)
+    row = uploads.begin_finalize(conn, uid, "mobile")
+    uploads.finish_finalize(conn, uid, row["path"], {"pred_label": "dog_barking_no_speech"})
+    assert not os.path.exists(row["path"])
+
+    # repeating finalize returns the stored result instead of running the model again
+    row = uploads.begin_finalize(conn, uid, "mobile")
+    assert row["status"] == uploads.STATUS_FINALIZED
+    assert uploads.to_public(row)["result"] == {"pred_label": "dog_barking_no_speech"}
+
+
+def test_finalize_checks_the_checksum(conn):
+    uid = uploads.create(conn, "mobile", size=len(DATA))["id"]
+    uploads.append(conn, uid, "mobile", 0, DATA)
+    err = raises_status(422, uploads.begin_finalize, conn, uid, "mobile", checksum="0" * 64)
+    assert err.extra["actual"] == hashlib.sha256(DATA).hexdigest()
+    assert uploads.get(conn, uid, "mobile")["status"] == uploads.STATUS_OPEN
+    assert uploads.begin_finalize(conn, uid, "mobile", checksum="sha256:" + hashlib.sha256(DATA).hexdigest())
+
+
+def test_purge_expired_removes_sessions_and_data(conn):
+    expired = uploads.create(conn, "mobile", size=4)
+    live = uploads.create(conn, "mobile", size=4)
+    conn.execute("UPDATE uploads SET expires_at = 0 WHERE id = ?", (expired["id"],))
+    raises_status(404, uploads.get, conn, expired["id"], "mobile")
+    assert uploads.purge_expired(conn) == 1
+    assert not os.path.exists(expired["path"])
+    assert uploads.get(conn, live["id"], "mobile")["status"] == uploads.STATUS_OPEN
+
+
+def test_open_sessions_are_capped_per_owner(conn):
+    first = uploads.create(conn, "mobile", size=4, max_open=2)
+    uploads.create(conn, "mobile", size=4, max_open=2)
+    err = raises_status(429, uploads.create, conn, "mobile", size=4, max_open=2)
+    assert err.extra["open"] == 2
+    # other keys have their own allowance, and finishing a session frees one up
+    uploads.create(conn, "batch", size=4, max_open=2)
+    uploads.delete(conn, first["id"], "mobile")
+    uploads.create(conn, "mobile", size=4, max_open=2)
@@ -0,0 +1,240 @@
+"""Resumable chunked uploads.
+
+A client creates an upload session, appends chunks at explicit byte offsets
+(resuming from the server's offset after a dropped connection) and finalizes
+once; inference runs only on finalize. Session metadata lives in SQLite and
+chunk data is spooled to a file per session, so any gunicorn worker can serve
+any request. Sessions expire `UPLOAD_TTL` seconds after their last activity.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+
+
+DEFAULT_UPLOADS_DIR = os.path.join(tempfile.gettempdir(), "soundaware_uploads")
+
+STATUS_OPEN = "open"
+STATUS_FINALIZING = "finalizing"
+STATUS_FINALIZED = "finalized"
+
+
+class UploadError(Exception):
+    """Protocol error; `status` is the HTTP status to return."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+def uploads_dir():
+    d = os.environ.get("UPLOADS_DIR", DEFAULT_UPLOADS_DIR)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or os.path.join(uploads_dir(), "uploads.sqlite3"), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            status TEXT NOT NULL,
+            filename TEXT,
+            path TEXT NOT NULL,
+            size INTEGER,
+            received INTEGER NOT NULL DEFAULT 0,
+            checksum TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            result TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS uploads_expires ON uploads (expires_at)")
+    return conn
+
+
+def parse_checksum(value):
+    """Accept "sha256:<hex>", "sha256=<hex>" or a bare hex SHA-256 digest."""
+    if not value:
+        return None
+    value = value.strip()
+    for prefix in ("sha256:", "sha256="):
+        if value.lower().startswith(prefix):
+            value = value[len(prefix):]
+    value = value.lower()
+    if len(value) != 64 or any(c not in "0123456789abcdef" for c in value):
+        raise UploadError("checksum must be a hex SHA-256 digest")
+    return value
+
+
+def to_public(row):
+    out = {
+        "upload_id": row["id"],
+        "status": row["status"],
+        "filename": row["filename"],
+        "size": row["size"],
+        "offset": row["received"],
+        "expires_at": row["expires_at"],
+    }
+    if row["result"]:
+        out["result"] = json.loads(row["result"])
+    return out
+
+
+def create(conn, owner, filename=None, size=None, checksum=None, ttl=3600, max_bytes=None, max_open=None):
+    """Start a session. `max_open` caps the owner's open sessions (429 when reached)."""
+    if size is not None:
+        size = int(size)
+        if size <= 0:
+            raise UploadError("size must be positive")
+        if max_bytes and size > max_bytes:
+            raise UploadError(f"upload exceeds {max_bytes} bytes", status=413)
+    checksum = parse_checksum(checksum)
+    upload_id = uuid.uuid4().hex
+    ext = os.path.splitext(filename or "")[1] or ".wav"
+    path = os.path.join(uploads_dir(), upload_id + ext)
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if max_open:
+            n_open = conn.execute(
+                "SELECT COUNT(*) FROM uploads WHERE owner = ? AND status = ? AND expires_at >= ?",
+                (owner, STATUS_OPEN, now),
+            ).fetchone()[0]
+            if n_open >= max_open:
+                raise UploadError(f"too many open uploads (limit {max_open}); finish or delete one first", status=429, open=n_open)
+        open(path, "wb").close()
+        conn.execute(
+            "INSERT INTO uploads (id, owner, status, filename, path, size, checksum, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, owner, STATUS_OPEN, filename, path, size, checksum, now, now + ttl),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return get(conn, upload_id, owner)
+
+
+def get(conn, upload_id, owner):
+    row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+    # other keys' uploads are indistinguishable from missing ones
+    if row is None or row["owner"] != owner or row["expires_at"] < time.time():
+        raise UploadError("unknown or expired upload", status=404)
+    return row
+
+
+def append(conn, upload_id, owner, offset, data, ttl=3600, max_bytes=None):
+    """Write `data` at `offset`. The offset must equal the bytes received so far."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = get(conn, upload_id, owner)
+        if row["status"] != STATUS_OPEN:
+            raise UploadError(f"upload is {row['status']}", status=409, offset=row["received"])
+        if offset != row["received"]:
+            # client is out of sync (e.g. a chunk was received but the response was lost)
+            raise UploadError("offset mismatch", status=409, offset=row["received"])
+        new_offset = offset + len(data)
+        limit = row["size"] or max_bytes
+        if limit and new_offset > limit:
+            raise UploadError(f"chunk extends past {limit} bytes", status=413, offset=row["received"])
+        with open(row["path"], "r+b") as fh:
+            fh.seek(offset)
+            fh.write(data)
+            fh.truncate()
+        conn.execute(
+            "UPDATE uploads SET received = ?, expires_at = ? WHERE id = ?",
+            (new_offset, time.time() + ttl, upload_id),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return new_offset
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def begin_finalize(conn, upload_id, owner, checksum=None):
+    """Check the upload is complete and matches its checksum, then claim it for inference.
+
+    Returns the row; if it is already finalized the row carries the cached result.
+    """
+    row = get(conn, upload_id, owner)
+    if row["status"] == STATUS_FINALIZED:
+        return row
+    if row["status"] == STATUS_FINALIZING:
+        raise UploadError("finalize already in progress", status=409, offset=row["received"])
+    if row["size"] is not None and row["received"] != row["size"]:
+        raise UploadError("upload incomplete", status=409, offset=row["received"], size=row["size"])
+    if row["received"] == 0:
+        raise UploadError("upload is empty", status=409, offset=0)
+    expected = parse_checksum(checksum) or row["checksum"]
+    if expected:
+        actual = file_sha256(row["path"])
+        if actual != expected:
+            raise UploadError("checksum mismatch", status=422, expected=expected, actual=actual)
+    # only one finalize wins, and only if no chunk landed while we were hashing
+    cur = conn.execute(
+        "UPDATE uploads SET status = ? WHERE id = ? AND status = ? AND received = ?",
+        (STATUS_FINALIZING, upload_id, STATUS_OPEN, row["received"]),
+    )
+    if cur.rowcount != 1:
+        raise UploadError("upload changed during finalize; retry", status=409)
+    return get(conn, upload_id, owner)
+
+
+def abort_finalize(conn, upload_id):
+    """Reopen an upload whose inference failed so the client can retry finalize."""
+    conn.execute(
+        "UPDATE uploads SET status = ? WHERE id = ? AND status = ?",
+        (STATUS_OPEN, upload_id, STATUS_FINALIZING),
+    )
+
+
+def finish_finalize(conn, upload_id, path, result, ttl=3600):
+    """Store the result so repeated finalize calls don't re-run the model, and drop the data."""
+    conn.execute(
+        "UPDATE uploads SET status = ?, result = ?, expires_at = ? WHERE id = ?",
+        (STATUS_FINALIZED, json.dumps(result), time.time() + ttl, upload_id),
+    )
+    remove_data(path)
+
+
+def remove_data(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+def delete(conn, upload_id, owner):
+    row = get(conn, upload_id, owner)
+    conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+    remove_data(row["path"])
+
+
+def purge_expired(conn):
+    """Drop expired sessions and their spooled data."""
+    rows = conn.execute("SELECT id, path FROM uploads WHERE expires_at < ?", (time.time(),)).fetchall()
+    for row in rows:
+        conn.execute("DELETE FROM uploads WHERE id = ?", (row["id"],))
+        remove_data(row["path"])
+    return len(rows)
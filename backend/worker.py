@@ -0,0 +1,176 @@
+"""Inference workers for the `/jobs` queue.
+
+Run alongside the web server, e.g.:
+
+    python worker.py --workers 2
+
+Each process loads its own interpreter once and then polls the SQLite queue
+from `jobs.py`, so inference capacity scales independently of gunicorn.
+"""
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+import jobs
+import uploads
+from inference import load_model, predict_file
+from scheduler import PRIORITIES, LiveDemandFlag
+from cascade import load_cascade
+
+
+def process_job(model, conn, job, worker_id, tag, cascade=None):
+    path = job["path"]
+    try:
+        try:
+            file_size = os.path.getsize(path)
+        except Exception:
+            file_size = -1
+        if file_size <= 44:
+            outcome = (jobs.STATUS_FAILED, f"uploaded file too small or empty (size={file_size})")
+        else:
+            outcome = (jobs.STATUS_DONE, predict_file(model, path, debug_mode=bool(job["debug"]), tag=tag, cascade=cascade))
+    except Exception as e:
+        print(f"[{tag}] job {job['id']} failed: {e}\n{traceback.format_exc()}")
+        outcome = (jobs.STATUS_FAILED, e)
+
+    # record the outcome before dropping the spooled upload: if this DB write raises,
+    # the job stays `running`, the stale sweep requeues it and the file is still there
+    if outcome[0] == jobs.STATUS_DONE:
+        recorded = jobs.complete(conn, job["id"], worker_id, outcome[1])
+    else:
+        recorded = jobs.fail(conn, job["id"], worker_id, outcome[1])
+    if not recorded:
+        # requeued while we ran (we looked dead): the new owner needs the file
+        print(f"[{tag}] job {job['id']} was reassigned; discarding our outcome")
+        return
+    jobs.remove_spool(path)
+
+
+def heartbeat_thread(worker_id, interval, tag):
+    """Keep checking in while a long job runs, so the job isn't requeued as stale."""
+    def run():
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = jobs.connect()
+                jobs.heartbeat(conn, worker_id)
+            except sqlite3.Error as e:
+                print(f"[{tag}] heartbeat failed: {e}")
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+            time.sleep(interval)
+    t = threading.Thread(target=run, name=f"{tag}-heartbeat", daemon=True)
+    t.start()
+    return t
+
+
+def purge_expired_uploads():
+    """Drop abandoned resumable-upload sessions even when no new uploads arrive."""
+    conn = uploads.connect()
+    try:
+        return uploads.purge_expired(conn)
+    finally:
+        conn.close()
+
+
+def worker_loop(worker_idx, poll_interval, stale_seconds, retention_seconds, heartbeat_seconds=5.0, live_backoff=1.0):
+    tag = f"worker-{worker_idx}"
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    model = load_model(project_root)
+    cascade = load_cascade(project_root, model['class_names'])
+    conn = jobs.connect()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_idx}"
+    # the web tier marks this while live requests wait for or hold a slot
+    live_flag = LiveDemandFlag() if live_backoff > 0 else None
+    heartbeat_thread(worker_id, heartbeat_seconds, tag)
+    print(f"[{tag}] ready (pid={os.getpid()} db={jobs.db_path()})")
+
+    last_sweep = 0.0
+    while True:
+        try:
+            now = time.time()
+
+            # only one worker needs to sweep, but it is cheap and idempotent
+            if now - last_sweep > max(stale_seconds / 4, 5):
+                try:
+                    n = jobs.requeue_stale(conn, stale_seconds)
+                    if n:
+                        print(f"[{tag}] requeued {n} stale job(s)")
+                    jobs.purge_finished(conn, retention_seconds)
+                    n = purge_expired_uploads()
+                    if n:
+                        print(f"[{tag}] purged {n} expired upload(s)")
+                except Exception as e:
+                    print(f"[{tag}] sweep failed: {e}")
+                last_sweep = now
+
+            # while live requests are active, only pick up live jobs and leave the
+            # CPU to the web tier; everything else waits for the next poll
+            backing_off = live_flag is not None and live_flag.active(live_backoff)
+            job = jobs.claim(conn, worker_id, "live" if backing_off else "bulk")
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            print(f"[{tag}] claimed job {job['id']} filename={job.get('filename')} priority={PRIORITIES[job['priority']]}")
+            process_job(model, conn, job, worker_id, tag, cascade)
+        except sqlite3.Error as e:
+            # e.g. "database is locked": keep the worker alive, reconnect and retry
+            print(f"[{tag}] database error: {e}; retrying")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            time.sleep(max(poll_interval, 1.0))
+            conn = jobs.connect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SoundAware inference job workers")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("JOB_WORKERS", "1")))
+    parser.add_argument("--poll-interval", type=float, default=float(os.environ.get("JOB_POLL_INTERVAL", "0.2")))
+    parser.add_argument("--stale-seconds", type=float, default=float(os.environ.get("JOB_STALE_SECONDS", "60")),
+                        help="requeue running jobs whose worker has not checked in for this long (crashed worker)")
+    parser.add_argument("--live-backoff", type=float, default=float(os.environ.get("JOB_LIVE_BACKOFF", "1.0")),
+                        help="hold back non-live jobs for this many seconds after a live request (0 disables)")
+    parser.add_argument("--retention-seconds", type=float, default=float(os.environ.get("JOB_RETENTION_SECONDS", "86400")),
+                        help="delete finished jobs older than this")
+    args = parser.parse_args(argv)
+
+    # make sure the schema exists before forking
+    jobs.connect().close()
+
+    if args.workers <= 1:
+        worker_loop(0, args.poll_interval, args.stale_seconds, args.retention_seconds, live_backoff=args.live_backoff)
+        return
+
+    procs = []
+    for i in range(args.workers):
+        p = multiprocessing.Process(
+            target=worker_loop,
+            args=(i, args.poll_interval, args.stale_seconds, args.retention_seconds),
+            kwargs={"live_backoff": args.live_backoff},
+            daemon=True,
+        )
+        p.start()
+        procs.append(p)
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
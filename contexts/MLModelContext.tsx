@@ -59,6 +59,10 @@ const defaultPerformance: ModelPerformance = {
   lastUpdated: new Date(),
 };
 
+// Chunk size and per-step retry budget for resumable uploads to /uploads
+const RESUMABLE_CHUNK_BYTES = 256 * 1024;
+const RESUMABLE_MAX_RETRIES = 5;
+
 const MLModelContext = createContext<MLModelContextType | undefined>(undefined);
 
 export function MLModelProvider({ children }: { children: React.ReactNode }) {
@@ -177,19 +181,134 @@ export function MLModelProvider({ children }: { children: React.ReactNode }) {
       : '';
     if (envKey) headers['x-api-key'] = envKey;
 
+    // Resumable upload: create a session, append chunks at explicit offsets (resyncing with the
+    // server after a dropped connection) and finalize once, so flaky mobile networks don't force
+    // a full re-upload. Returns null when the server or platform doesn't support it.
+    let cachedBlob: Blob | null | undefined;
+    const getBlob = async (): Promise<Blob | null> => {
+      if (cachedBlob === undefined) {
+        try {
+          const resp = await fetch(audioUri);
+          cachedBlob = await resp.blob();
+        } catch (e) {
+          cachedBlob = null;
+        }
+      }
+      return cachedBlob;
+    };
+
+    const sha256Hex = async (blob: Blob): Promise<string | undefined> => {
+      const subtle = (globalThis as any).crypto?.subtle;
+      if (!subtle || typeof (blob as any).arrayBuffer !== 'function') return undefined;
+      const digest = await subtle.digest('SHA-256', await (blob as any).arrayBuffer());
+      return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+    };
+
+    const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    // How long to wait before retrying a resumable-upload request, or null to fail fast.
+    // `res` is null for network errors. Only network errors, 409 (offset/finalize race) and
+    // 503 (server busy) are retried with backoff; 429 waits for the server's Retry-After.
+    const retryDelayMs = (res: Response | null, attempt: number): number | null => {
+      if (res === null || res.status === 409 || res.status === 503) return 500 * attempt;
+      if (res.status === 429) {
+        const after = Number(res.headers.get('Retry-After'));
+        return Number.isFinite(after) && after > 0 ? after * 1000 : 500 * attempt;
+      }
+      return null;
+    };
+
+    const uploadResumable = async (root: string): Promise<any | null> => {
+      const blob = await getBlob();
+      if (!blob || !blob.size || typeof blob.slice !== 'function') return null;
+      const filename = audioUri.split('/').pop() || `recording_${Date.now()}.wav`;
+      const checksum = await sha256Hex(blob).catch(() => undefined);
+
+      const created = await fetch(`${root}/uploads`, {
+        method: 'POST',
+        headers: { ...headers, 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename, size: blob.size, checksum }),
+      });
+      if (!created.ok) return null; // older server without /uploads: fall back to /predict
+      const session = await created.json();
+      const uploadUrl = `${root}/uploads/${session.upload_id}`;
+
+      let offset = 0;
+      let failures = 0;
+      while (offset < blob.size) {
+        let res: Response | null = null;
+        let json: any = {};
+        try {
+          res = await fetch(uploadUrl, {
+            method: 'PATCH',
+            headers: { ...headers, 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) },
+            body: blob.slice(offset, offset + RESUMABLE_CHUNK_BYTES) as any,
+          });
+          json = await res.json().catch(() => ({}));
+        } catch (err) {
+          res = null; // connection dropped
+        }
+        if (res && (res.ok || res.status === 409) && typeof json.offset === 'number') {
+          // on 409 the server tells us where it actually is
+          offset = json.offset;
+          failures = 0;
+          continue;
+        }
+        // a 2xx whose body got lost is a network problem too: resync below
+        const delay = retryDelayMs(res && !res.ok ? res : null, ++failures);
+        if (delay === null || failures > RESUMABLE_MAX_RETRIES) {
+          throw new Error(res ? `Upload chunk failed ${res.status}: ${json.error}` : 'Upload chunk failed: network error');
+        }
+        await sleep(delay);
+        try {
+          const status = await fetch(uploadUrl, { headers });
+          if (status.ok) offset = (await status.json()).offset;
+        } catch (e) {
+          // still offline; retry the same offset
+        }
+      }
+
+      // finalize is idempotent: a retry after a lost response returns the stored result.
+      // Other errors (e.g. 500 from inference) are not retried so the model isn't re-run.
+      for (let attempt = 1; ; attempt++) {
+        let res: Response | null = null;
+        let json: any = {};
+        try {
+          res = await fetch(`${uploadUrl}/finalize`, {
+            method: 'POST',
+            headers: { ...headers, 'Content-Type': 'application/json' },
+            body: JSON.stringify({ checksum }),
+          });
+          json = await res.json().catch(() => ({}));
+        } catch (err) {
+          res = null;
+        }
+        if (res && res.ok && json.result) return json.result;
+        const delay = retryDelayMs(res && !res.ok ? res : null, attempt);
+        if (delay === null || attempt > RESUMABLE_MAX_RETRIES) {
+          throw new Error(res ? `Finalize failed ${res.status}: ${json.error}` : 'Finalize failed: network error');
+        }
+        await sleep(delay);
+      }
+    };
+
     // Try each candidate sequentially until one succeeds
     let lastError: any = null;
     for (const base of candidates) {
-      const url = `${base.replace(/\/$/, '')}/predict`;
+      const root = base.replace(/\/$/, '');
+      const url = `${root}/predict`;
       try {
-        const res = await fetch(url, { method: 'POST', body: form as any, headers });
-        if (!res.ok) {
-          lastError = new Error(`Server error ${res.status} from ${url}`);
-          console.warn('processAudio: server returned non-OK', res.status, url);
-          continue; // try next candidate
+        let json: any = await uploadResumable(root);
+        if (json === null) {
+          const res = await fetch(url, { method: 'POST', body: form as any, headers });
+          if (!res.ok) {
+            lastError = new Error(`Server error ${res.status} from ${url}`);
+            console.warn('processAudio: server returned non-OK', res.status, url);
+            continue; // try next candidate
+          }
+          json = await res.json();
         }
 
-        const json = await res.json();
         const pred_label: string = json.pred_label || (json.pred_label && String(json.pred_label)) || 'unknown';
         const pred_idx: number = typeof json.pred_idx === 'number' ? json.pred_idx : -1;
         const scores: number[] = Array.isArray(json.scores) ? json.scores : [];